@@ -0,0 +1,413 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(BASE_DIR, "client")
+SERVER_DIR = os.path.join(BASE_DIR, "server")
+for path in (BASE_DIR, CLIENT_DIR, os.path.join(CLIENT_DIR, "data"), SERVER_DIR):
+    sys.path.append(path)
+
+import decrypt
+import encrypt
+import keystore
+from common.container import ContainerReader
+from common.profiles import PROFILES, depth, get_profile
+from generate_synthetic_data import generate_diabetes_dataset
+from inference import InferenceEngine, PARAMS_PATH, MODEL_DEPTH, activation_depth
+
+# --- Encrypted inference benchmark ---
+# For every (row count, CKKS parameter set, encoding) this measures
+# encryption, in-process scoring, scoring over HTTP and decryption, and
+# writes p50/p95 latency, rows/sec, ciphertext bytes per row and peak RSS
+# as JSON so runs can be compared across commits. With --data it scores a
+# real CSV instead, which doubles as the per-profile precision check:
+#   python benchmark.py --profiles fast balanced deep --data server/data/diabetes.csv --repeat 1
+
+
+def parse_param_set(value):
+    # "8192:60,40,40,60" -> (8192, [60, 40, 40, 60]); the scale follows the
+    # inner primes (2**40 for 40-bit primes)
+    degree, _, bits = value.partition(":")
+    coeff_mod_bit_sizes = [int(b) for b in bits.split(",")] if bits else list(encrypt.COEFF_MOD_BIT_SIZES)
+    return int(degree), coeff_mod_bit_sizes
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is reported in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(latencies, rows):
+    latencies = np.array(latencies)
+    p50 = float(np.percentile(latencies, 50))
+    return {
+        "runs": len(latencies),
+        "p50_s": p50,
+        "p95_s": float(np.percentile(latencies, 95)),
+        "rows_per_s": rows / p50 if p50 > 0 else None,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def timed(fn, repeat):
+    latencies, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies, result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    """uvicorn serving server.py on a free local port for the HTTP stage."""
+
+    def __init__(self, workers=None):
+        self.port = free_port()
+        # PPML_INFERENCE_WORKERS for the server, or its default
+        self.workers = workers
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.proc = None
+        # Cold start: seconds until it accepted connections and until its
+        # model was warm, plus the server's own /readyz report
+        self.live_s = None
+        self.ready_s = None
+        self.readiness = None
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=SERVER_DIR,
+            env={**os.environ, "PPML_INFERENCE_WORKERS": str(self.workers)} if self.workers else None,
+            # Keep the report on stdout clean of the server's own messages
+            stdout=sys.stderr
+        )
+        deadline = time.time() + 300
+        while time.time() < deadline:
+            try:
+                response = requests.get(self.url + "/readyz", timeout=1)
+            except requests.ConnectionError:
+                time.sleep(0.02)
+                continue
+            if self.live_s is None:
+                self.live_s = time.perf_counter() - start
+            if response.status_code == 200:
+                self.ready_s = time.perf_counter() - start
+                self.readiness = response.json()
+                return self
+            time.sleep(0.02)
+        raise RuntimeError("Server did not come up")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def decrypt_predictions(context, predictions, repeat):
+    # Decryption reads the prediction container from disk like decrypt.py does
+    with tempfile.NamedTemporaryFile(suffix=".ppmc", delete=False) as f:
+        f.write(predictions)
+        predictions_path = f.name
+    try:
+        return timed(
+            lambda: decrypt.decrypt_scores(context, decrypt.iter_container_predictions(predictions_path)),
+            repeat
+        )
+    finally:
+        os.remove(predictions_path)
+
+
+def label_mismatches(probabilities, plain_probabilities):
+    # Predictions whose label flips compared to plaintext scoring
+    return int(np.sum(
+        np.asarray(decrypt.label_scores(probabilities)) != np.asarray(decrypt.label_scores(plain_probabilities))
+    ))
+
+
+def bench_case(df, degree, coeff_mod_bit_sizes, encoding, repeat, server, params, profile=None,
+               sigmoid_degrees=()):
+    n_rows = len(df)
+    X_poly = encrypt.prepare_features(df, params)
+    plain_scores = X_poly @ np.asarray(params["weights"]) + params["intercept"]
+    # What LogisticRegression.predict_proba gives for the trained weights
+    plain_probabilities = 1 / (1 + np.exp(-plain_scores))
+    result = {
+        "rows": n_rows,
+        "profile": profile,
+        "poly_modulus_degree": degree,
+        "coeff_mod_bit_sizes": coeff_mod_bit_sizes,
+        "encoding": encoding,
+        "stages": {}
+    }
+    stages = result["stages"]
+
+    # Key generation is reported apart from encryption, it happens once per
+    # parameter set; like the client, only rotating kernels get Galois keys
+    start = time.perf_counter()
+    context = encrypt.create_context(degree, coeff_mod_bit_sizes, 2 ** coeff_mod_bit_sizes[1],
+                                     galois_keys=keystore.needs_galois_keys(encoding))
+    stages["keygen"] = {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+    public_context = context.serialize()
+    result["public_context_bytes"] = len(public_context)
+
+    def run_encrypt():
+        out = io.BytesIO()
+        encrypt.write_container(out, encrypt.encrypt_units(context, X_poly, encoding, degree),
+                                encoding, public_context, X_poly.shape[1],
+                                profile=get_profile(profile) if profile else None)
+        return out.getvalue()
+
+    latencies, container = timed(run_encrypt, repeat)
+    stages["encrypt"] = summarize(latencies, n_rows)
+    result["ciphertext_bytes"] = len(container)
+    result["ciphertext_bytes_per_row"] = len(container) / n_rows
+
+    # In-process scoring; the first run pays context deserialization
+    engine = InferenceEngine(PARAMS_PATH)
+
+    def run_inference():
+        out = io.BytesIO()
+        with ContainerReader(container) as reader:
+            engine.predict_container(reader, public_context, out)
+        return out.getvalue()
+
+    latencies, predictions = timed(run_inference, repeat)
+    stages["inference"] = summarize(latencies, n_rows)
+    stages["inference"]["cold_s"] = latencies[0]
+    result["prediction_bytes_per_row"] = len(predictions) / n_rows
+
+    if server is not None:
+        def run_http():
+            resp = requests.post(server.url + "/predict/", files={
+                "encrypted": ("encrypted_user_data.ppmc", container, "application/octet-stream"),
+                "context": ("context_public.ckks", public_context, "application/octet-stream")
+            })
+            resp.raise_for_status()
+            return resp.content
+
+        latencies, _ = timed(run_http, repeat)
+        stages["http"] = summarize(latencies, n_rows)
+        stages["http"]["cold_s"] = latencies[0]
+
+    latencies, scores = decrypt_predictions(context, predictions, repeat)
+    stages["decrypt"] = summarize(latencies, n_rows)
+    errors = np.abs(np.asarray(scores) - plain_scores)
+    result["max_abs_error"] = float(np.max(errors))
+    result["mean_abs_error"] = float(np.mean(errors))
+    result["label_mismatches"] = label_mismatches(decrypt.to_probabilities(scores), plain_probabilities)
+
+    # Encrypted sigmoid: extra scoring latency and probability error against
+    # predict_proba, for every degree the profile has depth for
+    result["sigmoid"] = []
+    for sigmoid_degree in sigmoid_degrees:
+        needed = MODEL_DEPTH + activation_depth(sigmoid_degree)
+        entry = {"degree": sigmoid_degree, "depth": needed}
+        result["sigmoid"].append(entry)
+        if depth(coeff_mod_bit_sizes) < needed:
+            entry["skipped"] = f"profile depth {depth(coeff_mod_bit_sizes)} < {needed}"
+            continue
+
+        def run_sigmoid():
+            out = io.BytesIO()
+            with ContainerReader(container) as reader:
+                engine.predict_container(reader, public_context, out, sigmoid_degree=sigmoid_degree)
+            return out.getvalue()
+
+        latencies, sigmoid_predictions = timed(run_sigmoid, repeat)
+        entry.update(summarize(latencies, n_rows))
+        entry["overhead_s"] = entry["p50_s"] - stages["inference"]["p50_s"]
+        _, probabilities = decrypt_predictions(context, sigmoid_predictions, 1)
+        probabilities = decrypt.to_probabilities(probabilities, "sigmoid")
+        errors = np.abs(np.asarray(probabilities) - plain_probabilities)
+        entry["max_abs_error"] = float(np.max(errors))
+        entry["mean_abs_error"] = float(np.mean(errors))
+        entry["label_mismatches"] = label_mismatches(probabilities, plain_probabilities)
+    return result
+
+
+def bench_load(df, degree, coeff_mod_bit_sizes, encoding, levels, repeat, server, params, profile=None):
+    # Throughput of /predict/ with `level` clients sending at once, each
+    # sending `repeat` requests; the context is registered once, as the
+    # client library does, so requests carry only the ciphertexts
+    X_poly = encrypt.prepare_features(df, params)
+    context = encrypt.create_context(degree, coeff_mod_bit_sizes, 2 ** coeff_mod_bit_sizes[1],
+                                     galois_keys=keystore.needs_galois_keys(encoding))
+    public_context = context.serialize()
+    out = io.BytesIO()
+    encrypt.write_container(out, encrypt.encrypt_units(context, X_poly, encoding, degree),
+                            encoding, public_context, X_poly.shape[1],
+                            profile=get_profile(profile) if profile else None)
+    container = out.getvalue()
+    requests.post(server.url + "/contexts/", files={"context": public_context}).raise_for_status()
+
+    def send():
+        start = time.perf_counter()
+        resp = requests.post(server.url + "/predict/", files={
+            "encrypted": ("encrypted_user_data.ppmc", container, "application/octet-stream")
+        })
+        resp.raise_for_status()
+        return time.perf_counter() - start
+
+    send()  # the first request parses the context
+    result = {
+        "rows": len(df),
+        "profile": profile,
+        "poly_modulus_degree": degree,
+        "coeff_mod_bit_sizes": coeff_mod_bit_sizes,
+        "encoding": encoding,
+        "server_workers": server.workers,
+        "levels": []
+    }
+    for level in levels:
+        n_requests = level * repeat
+        with ThreadPoolExecutor(max_workers=level) as clients:
+            start = time.perf_counter()
+            latencies = list(clients.map(lambda _: send(), range(n_requests)))
+            elapsed = time.perf_counter() - start
+        result["levels"].append({
+            "concurrency": level,
+            "requests": n_requests,
+            "requests_per_s": n_requests / elapsed,
+            "rows_per_s": n_requests * len(df) / elapsed,
+            "p50_s": float(np.percentile(latencies, 50)),
+            "p95_s": float(np.percentile(latencies, 95))
+        })
+    return result
+
+
+def bench_cold_start(repeat):
+    # Start a fresh server `repeat` times; live is when it accepts
+    # connections, which the server's startup budget covers
+    runs = []
+    for _ in range(repeat):
+        with ServerProcess() as server:
+            runs.append(server)
+    budget = runs[-1].readiness["startup_budget_seconds"]
+    live = np.array([server.live_s for server in runs])
+    return {
+        "runs": repeat,
+        "live_p50_s": float(np.percentile(live, 50)),
+        "live_p95_s": float(np.percentile(live, 95)),
+        "ready_p50_s": float(np.percentile([server.ready_s for server in runs], 50)),
+        "import_p50_s": float(np.percentile([server.readiness["import_seconds"] for server in runs], 50)),
+        "warmup_p50_s": float(np.percentile([server.readiness["warmup_seconds"] for server in runs], 50)),
+        "budget_s": budget,
+        "within_budget": bool(live.max() <= budget)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the encrypted inference pipeline")
+    parser.add_argument("--rows", type=int, nargs="+", default=[64, 512],
+                        help="synthetic row counts to benchmark")
+    parser.add_argument("--data", default=None,
+                        help="benchmark this CSV (e.g. server/data/diabetes.csv) instead of synthetic rows")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=None,
+                        help="named CKKS profiles to benchmark (default: the balanced profile)")
+    parser.add_argument("--params", type=parse_param_set, nargs="+", default=[],
+                        help="extra CKKS parameter sets as poly_modulus_degree:coeff_mod_bit_sizes")
+    parser.add_argument("--encodings", nargs="+", choices=["row", "packed", "column"],
+                        default=["row", "packed", "column"])
+    parser.add_argument("--sigmoid-degrees", type=int, nargs="*", default=[],
+                        help="also score through the encrypted sigmoid at these polynomial degrees")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--http", action="store_true", help="also benchmark /predict/ over HTTP")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[],
+                        help="also load-test /predict/ with this many concurrent clients per level, "
+                             "using the first row count, parameter set and encoding")
+    parser.add_argument("--server-workers", type=int, default=None,
+                        help="scoring processes of the benchmarked server (PPML_INFERENCE_WORKERS)")
+    parser.add_argument("--cold-starts", type=int, default=0,
+                        help="also start a fresh server this many times and time it against the startup budget")
+    parser.add_argument("--output", default="-", help="JSON report path, '-' for stdout")
+    args = parser.parse_args()
+
+    # The server's trained bundle defines the features and weights
+    if not os.path.exists(PARAMS_PATH):
+        subprocess.run([sys.executable, "train.py"], cwd=SERVER_DIR, check=True)
+    params = encrypt.load_params(PARAMS_PATH)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat
+        },
+        "results": []
+    }
+
+    # (profile name, degree, coeff_mod_bit_sizes) for every parameter set to run
+    param_sets = []
+    for name in args.profiles or ([] if args.params else ["balanced"]):
+        profile = get_profile(name)
+        param_sets.append((name, profile["poly_modulus_degree"], profile["coeff_mod_bit_sizes"]))
+    param_sets += [(None, degree, coeff_mod_bit_sizes) for degree, coeff_mod_bit_sizes in args.params]
+
+    if args.data:
+        datasets = [pd.read_csv(args.data)]
+        report["meta"]["data"] = args.data
+    else:
+        datasets = [generate_diabetes_dataset(n_rows) for n_rows in args.rows]
+
+    with ServerProcess(args.server_workers) if args.http or args.concurrency else contextlib.nullcontext() as server:
+        for name, degree, coeff_mod_bit_sizes in param_sets:
+            for df in datasets:
+                for encoding in args.encodings:
+                    print(f"Benchmarking {len(df)} rows, N={degree} {coeff_mod_bit_sizes}, {encoding}...",
+                          file=sys.stderr)
+                    report["results"].append(
+                        bench_case(df, degree, coeff_mod_bit_sizes, encoding, args.repeat,
+                                   server if args.http else None, params, name, args.sigmoid_degrees)
+                    )
+        if args.concurrency:
+            name, degree, coeff_mod_bit_sizes = param_sets[0]
+            print(f"Load testing {len(datasets[0])} rows at concurrency {args.concurrency}...", file=sys.stderr)
+            report["load"] = bench_load(datasets[0], degree, coeff_mod_bit_sizes, args.encodings[0],
+                                        args.concurrency, args.repeat, server, params, name)
+    if args.cold_starts:
+        print(f"Timing {args.cold_starts} server cold starts...", file=sys.stderr)
+        report["cold_start"] = bench_cold_start(args.cold_starts)
+    if args.http or args.concurrency or args.cold_starts:
+        # Child processes have exited by now, so this includes the server
+        report["meta"]["server_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Saved benchmark report to {args.output}", file=sys.stderr)
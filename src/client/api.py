@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import framing
+from common.container import ContainerReader, ContainerWriter
+
+SERVER_URL = os.environ.get("PPML_SERVER_URL", "http://localhost:8000")
+
+# --- Transfer settings ---
+# A container is scored as several /predict/stream requests of about
+# CHUNK_ROWS patient rows, at most MAX_IN_FLIGHT at a time over pooled
+# keep-alive connections. A chunk that fails with a connection error, a
+# timeout or a 5xx is sent again with exponential backoff, and finished
+# chunks are kept on disk so an interrupted run resumes where it stopped.
+# Ciphertexts don't compress (SEAL already packs them), so bodies are sent
+# as stored: zstd containers go out and come back zstd-compressed.
+CHUNK_ROWS      = 4096
+MAX_IN_FLIGHT   = 4
+RETRIES         = 3
+BACKOFF         = 1.0
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT    = 600
+STREAM_BLOCK    = 1024 * 1024
+POLL_INTERVAL   = 1.0
+MANIFEST_NAME   = "manifest.json"
+
+
+class ServerError(Exception):
+    def __init__(self, status, detail, retry_after=None):
+        super().__init__(f"Server error {status}: {detail}")
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        # Overload and server-side failures; 4xx answers won't change on retry
+        return self.status >= 500 or self.status == 429
+
+
+def _error_detail(resp):
+    try:
+        return resp.json().get("detail", resp.text)
+    except ValueError:
+        return resp.text
+
+
+def chunk_ranges(reader, chunk_rows=CHUNK_ROWS):
+    # Consecutive ranges of whole units holding about chunk_rows patient rows each
+    ranges, start, rows = [], 0, 0
+    for i in range(reader.unit_count):
+        rows += reader.unit_rows(i)
+        if rows >= chunk_rows:
+            ranges.append(range(start, i + 1))
+            start, rows = i + 1, 0
+    if start < reader.unit_count:
+        ranges.append(range(start, reader.unit_count))
+    return ranges
+
+
+def input_fingerprint(path, reader):
+    # Identifies the container a run's finished chunks belong to
+    stat = os.stat(path)
+    key = json.dumps([reader.header, reader.row_count, stat.st_size, stat.st_mtime_ns], sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def receive_predictions(resp, path, on_rows=None):
+    # Write a framed prediction stream into a container at `path`, relaying
+    # the blobs as they arrive. Raises FrameError if the stream ends early
+    tmp_path = path + ".tmp"
+    decoder = framing.FrameDecoder()
+    writer = None
+    with open(tmp_path, "wb") as f:
+        for data in resp.iter_content(chunk_size=STREAM_BLOCK):
+            for kind, payload in decoder.feed(data):
+                if kind == framing.KIND_HEADER:
+                    writer = ContainerWriter(f, **framing.decode_header(payload))
+                elif kind == framing.KIND_UNIT:
+                    rows, parts = framing.decode_unit(payload)
+                    writer.add_unit(rows, parts, compressed=True)
+                    if on_rows is not None:
+                        on_rows(rows)
+        if not decoder.finished or writer is None:
+            raise framing.FrameError("Prediction stream ended early; the server failed mid-batch")
+        writer.close()
+    os.replace(tmp_path, path)
+    return writer.row_count
+
+
+def join_containers(paths, out_path):
+    # Concatenate prediction containers (in order) into one
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        writer = None
+        for path in paths:
+            with ContainerReader(path) as part:
+                if writer is None:
+                    writer = ContainerWriter(f, **part.header)
+                for rows, parts in part.iter_units(raw=True):
+                    writer.add_unit(rows, parts, compressed=True)
+        writer.close()
+    os.replace(tmp_path, out_path)
+    return writer.row_count
+
+
+class PPMLClient:
+    """Pooled keep-alive connections to the PPML server, with retries."""
+
+    def __init__(self, url=SERVER_URL, max_in_flight=MAX_IN_FLIGHT, retries=RETRIES, backoff=BACKOFF,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), pool_size=None):
+        self.url = url.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        # urllib3 retries idempotent calls itself; uploads are retried by
+        # _with_retries, which rebuilds the body for every attempt
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      allowed_methods=("GET", "HEAD", "DELETE"), raise_on_status=False)
+        # Size the pool for every thread sharing this client
+        adapter = HTTPAdapter(pool_maxsize=pool_size or max_in_flight + 2, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _request(self, method, path, ok=(200,), **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        resp = self.session.request(method, self.url + path, **kwargs)
+        if resp.status_code not in ok:
+            error = ServerError(resp.status_code, _error_detail(resp), resp.headers.get("Retry-After"))
+            resp.close()
+            raise error
+        return resp
+
+    def _with_retries(self, attempt):
+        # Call attempt() again after connection errors, timeouts, truncated
+        # streams and 5xx answers, backing off exponentially or as long as
+        # the server's Retry-After asks
+        for n in range(self.retries + 1):
+            try:
+                return attempt()
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    framing.FrameError, ServerError) as e:
+                if n == self.retries or (isinstance(e, ServerError) and not e.retryable):
+                    raise
+                delay = self.backoff * 2 ** n
+                if isinstance(e, ServerError) and e.retry_after:
+                    try:
+                        delay = max(delay, float(e.retry_after))
+                    except ValueError:
+                        pass
+                time.sleep(delay)
+
+    # --- Models and contexts ---
+
+    def models(self):
+        return self._request("GET", "/models/").json()
+
+    def fetch_params(self, path):
+        # Download the server's current params.pkl unless the copy at `path`
+        # is already that version (ETag revalidation). Returns the model
+        # version, or None when the local copy was up to date
+        etag_path = path + ".etag"
+        headers = {}
+        if os.path.exists(path) and os.path.exists(etag_path):
+            with open(etag_path) as f:
+                headers["If-None-Match"] = f.read().strip()
+        resp = self._request("GET", "/params/", ok=(200, 304), headers=headers)
+        if resp.status_code == 304:
+            return None
+        with open(path, "wb") as f:
+            f.write(resp.content)
+        with open(etag_path, "w") as f:
+            f.write(resp.headers.get("ETag", ""))
+        return resp.headers.get("X-Model-Version")
+
+    def ensure_context(self, context_bytes):
+        # Handshake: upload the public context only if the server doesn't know it yet
+        key = hashlib.sha256(context_bytes).hexdigest()
+        resp = self._request("GET", f"/contexts/{key}", ok=(200, 404))
+        if resp.status_code == 404:
+            self._with_retries(lambda: self._request(
+                "POST", "/contexts/",
+                files={"context": ("context_public.ckks", context_bytes, "application/octet-stream")}
+            ))
+        return key
+
+    # --- Streamed scoring ---
+
+    def predict_units(self, reader, out_path, units=None, model_version=None, on_rows=None, context_bytes=None):
+        # Score some units of a container (all by default) in one streamed
+        # request, retried as a whole on failure. Pass context_bytes unless
+        # the container names a context registered with ensure_context()
+        params = {"model_version": model_version} if model_version else None
+
+        def attempt():
+            received = [0]
+
+            def count(rows):
+                received[0] += rows
+                if on_rows is not None:
+                    on_rows(rows)
+
+            try:
+                resp = self._request(
+                    "POST", "/predict/stream", params=params,
+                    data=framing.iter_stream(reader.header, reader.iter_units(units, raw=True), context_bytes),
+                    headers={"Content-Type": framing.MEDIA_TYPE}, stream=True
+                )
+                with resp:
+                    return receive_predictions(resp, out_path, count)
+            except BaseException:
+                # Rows of a failed attempt are counted again by the next one
+                if on_rows is not None and received[0]:
+                    on_rows(-received[0])
+                raise
+
+        return self._with_retries(attempt)
+
+    def predict_container(self, in_path, out_path, context_bytes, chunk_rows=CHUNK_ROWS, progress=None):
+        # Score a ciphertext container into a prediction container at
+        # out_path, as concurrent chunk requests. Finished chunks stay in
+        # out_path + ".parts" until the run completes, so calling this again
+        # after a failure only sends the missing ones. progress(rows done,
+        # rows total) is called from this thread
+        key = self.ensure_context(context_bytes)
+        work_dir = out_path + ".parts"
+        with ContainerReader(in_path) as reader:
+            if reader.header.get("context_hash") not in (None, key):
+                raise ValueError("Ciphertexts were not encrypted under the provided context")
+            # Containers that don't name their context carry it in every chunk
+            inline_context = None if reader.header.get("context_hash") else context_bytes
+            if reader.unit_count == 0:
+                raise ValueError(f"{in_path} holds no ciphertexts")
+            # Pin every chunk to one model version, so a swap mid-run can't mix models
+            version = reader.header.get("model_version") or self.models()["current"]
+            ranges = chunk_ranges(reader, chunk_rows)
+            paths = [os.path.join(work_dir, f"part-{i:05d}.ppmc") for i in range(len(ranges))]
+            manifest = {"input": input_fingerprint(in_path, reader), "chunk_rows": chunk_rows,
+                        "model_version": version}
+            done = self._resume(work_dir, manifest, paths)
+
+            lock = threading.Lock()
+            rows_done = [sum(reader.unit_rows(i) for idx in done for i in ranges[idx])]
+
+            def on_rows(rows):
+                with lock:
+                    rows_done[0] += rows
+
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+                pending = {pool.submit(self.predict_units, reader, paths[idx], units, version, on_rows, inline_context)
+                           for idx, units in enumerate(ranges) if idx not in done}
+                while pending:
+                    finished, pending = wait(pending, timeout=0.25, return_when=FIRST_EXCEPTION)
+                    if progress is not None:
+                        progress(rows_done[0], reader.row_count)
+                    for future in finished:
+                        if future.exception() is not None:
+                            # Let the other chunks finish so a rerun can skip them
+                            wait(pending)
+                            raise future.exception()
+
+        rows = join_containers(paths, out_path)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return rows
+
+    def _resume(self, work_dir, manifest, paths):
+        # Indices of chunks finished by an earlier run of the same input;
+        # parts of any other run are discarded
+        manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                if json.load(f) == manifest:
+                    return {idx for idx, path in enumerate(paths) if os.path.exists(path)}
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+        return set()
+
+    # --- Background jobs ---
+
+    def submit_job(self, in_path, context_key, model_version=None):
+        params = {"model_version": model_version} if model_version else None
+
+        def attempt():
+            with open(in_path, "rb") as f:
+                files = {"encrypted": (os.path.basename(in_path), f, "application/octet-stream")}
+                return self._request("POST", "/jobs/", params=params, files=files,
+                                     data={"context_hash": context_key}).json()
+
+        return self._with_retries(attempt)
+
+    def wait_job(self, job_id, progress=None, poll_interval=POLL_INTERVAL):
+        # Poll until the job is done or failed; progress(job) after each poll
+        while True:
+            job = self._request("GET", f"/jobs/{job_id}").json()
+            if progress is not None:
+                progress(job)
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(poll_interval)
+
+    def download_job(self, job_id, out_path):
+        # Fetch a finished job's predictions, then free them on the server
+        def attempt():
+            with self._request("GET", f"/jobs/{job_id}/result", stream=True) as resp:
+                tmp_path = out_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    for data in resp.iter_content(chunk_size=STREAM_BLOCK):
+                        f.write(data)
+                os.replace(tmp_path, out_path)
+
+        self._with_retries(attempt)
+        self._request("DELETE", f"/jobs/{job_id}", ok=(200, 404))
@@ -0,0 +1,322 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.container import ContainerReader, COMPRESSIONS
+from common.profiles import PROFILES, DEFAULT_PROFILE, get_profile
+import encrypt
+import decrypt
+from api import PPMLClient, ServerError, SERVER_URL, CHUNK_ROWS, MAX_IN_FLIGHT
+
+OUTPUT_DIR    = "./batch_output"
+MANIFEST_NAME = "batch.json"
+WORK_NAME     = "work"
+
+# --- Batch runs ---
+# Every CSV goes through encrypt -> submit -> decrypt. The stages of
+# different files overlap: while some files are being scored by the server,
+# the next ones encrypt and finished ones decrypt on a process pool. Each
+# stage's output is kept under <out>/work and the run's progress in
+# <out>/batch.json, so running the same command again skips finished work
+# (and a half-sent file resumes chunk by chunk).
+STAGES = ("encrypt", "submit", "decrypt")
+
+
+def find_inputs(patterns):
+    # CSVs in the given directories or matching the given globs, in order
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found += sorted(glob.glob(os.path.join(pattern, "*.csv")))
+        else:
+            found += sorted(glob.glob(pattern))
+    return list(dict.fromkeys(os.path.abspath(path) for path in found))
+
+
+def file_names(paths):
+    # Output name per input: its stem, plus a path hash when two inputs share one
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    return {
+        path: stem if stems.count(stem) == 1 else f"{stem}-{hashlib.sha256(path.encode()).hexdigest()[:8]}"
+        for path, stem in zip(paths, stems)
+    }
+
+
+def input_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# --- Pool worker state ---
+# Keys are loaded once per process, without touching the fixed context paths
+_worker_contexts = {}
+
+
+def _worker_context(encoding, profile_name):
+    key = (encoding, profile_name)
+    if key not in _worker_contexts:
+        _worker_contexts[key] = encrypt.load_context(encoding, get_profile(profile_name), activate=False)
+    return _worker_contexts[key]
+
+
+def _encrypt_job(csv_path, out_path, options):
+    started = time.perf_counter()
+    writer = encrypt.encrypt_file(
+        csv_path, out_path, options["encoding"], options["profile"], options["features"],
+        activation=encrypt.activation_fields(options["sigmoid"], options["sigmoid_degree"]),
+        outputs=encrypt.model_fields(options["models"], options["ensemble"]),
+        compression=options["compression"],
+        contexts=_worker_context(options["encoding"], options["profile"])
+    )
+    return {"rows": writer.row_count}, time.perf_counter() - started
+
+
+def _decrypt_job(pred_path, stem, formats):
+    started = time.perf_counter()
+    summary = decrypt.decrypt_file(pred_path, pred_path, stem=stem, formats=formats)
+    return summary, time.perf_counter() - started
+
+
+class BatchRun:
+    """Moves CSVs through encrypt, submit and decrypt, overlapping the stages of different files."""
+
+    def __init__(self, inputs, out_dir, api, options, formats=("csv",), workers=1, in_flight=2,
+                 chunk_rows=CHUNK_ROWS, keep_work=False):
+        self.out_dir = out_dir
+        self.work_dir = os.path.join(out_dir, WORK_NAME)
+        self.api = api
+        self.options = options
+        self.formats = list(formats)
+        self.workers = workers
+        self.in_flight = in_flight
+        self.chunk_rows = chunk_rows
+        self.keep_work = keep_work
+        self.names = file_names(inputs)
+        self.manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+        self.files = self._load_manifest()
+
+    # --- Progress on disk ---
+
+    def _load_manifest(self):
+        # Entries of an earlier run with the same options, for inputs that
+        # haven't changed since; everything else starts over
+        previous = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("options") == self.options:
+                previous = manifest["files"]
+        files = {}
+        for path, name in self.names.items():
+            entry = previous.get(name)
+            if entry is None or entry["input"] != path or entry["fingerprint"] != input_fingerprint(path):
+                entry = {"input": path, "fingerprint": input_fingerprint(path), "done": [], "seconds": {}}
+            entry.pop("error", None)
+            files[name] = entry
+        return files
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"options": self.options, "files": self.files}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def encrypted_path(self, name):
+        return os.path.join(self.work_dir, name + ".ppmc")
+
+    def predictions_path(self, name):
+        return os.path.join(self.work_dir, name + ".predictions.ppmc")
+
+    def next_stage(self, name):
+        done = self.files[name]["done"]
+        return next((stage for stage in STAGES if stage not in done), None)
+
+    def _check_keys(self, context_key):
+        # Ciphertexts from a run under other keys have to be encrypted again
+        for name, entry in self.files.items():
+            if "encrypt" in entry["done"] and "submit" not in entry["done"]:
+                path = self.encrypted_path(name)
+                if not os.path.exists(path):
+                    entry["done"] = []
+                    continue
+                with ContainerReader(path) as reader:
+                    if reader.header.get("context_hash") != context_key:
+                        entry["done"] = []
+
+    # --- Pipeline ---
+
+    def run(self, public_context, log=print):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._check_keys(hashlib.sha256(public_context).hexdigest())
+        self._save_manifest()
+        waiting = {stage: [name for name in self.names.values() if self.next_stage(name) == stage]
+                   for stage in STAGES}
+        total = len(self.names)
+        finished = total - sum(len(names) for names in waiting.values())
+        if finished:
+            log(f"Resuming: {finished}/{total} files already done")
+
+        started = time.perf_counter()
+        failed = []
+        processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        threads = ThreadPoolExecutor(max_workers=self.in_flight)
+        active = {}
+        try:
+            while True:
+                self._schedule(waiting, active, processes, threads, public_context)
+                if not active:
+                    break
+                completed, _ = wait(active, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    name, stage = active.pop(future)
+                    entry = self.files[name]
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        entry["error"] = f"{stage} failed: {e}"
+                        failed.append(name)
+                        log(f"[{finished}/{total}] {name}: {entry['error']}")
+                        self._save_manifest()
+                        continue
+                    entry["done"].append(stage)
+                    entry["seconds"][stage] = round(seconds, 3)
+                    entry.update({key: value for key, value in result.items() if key != "paths"})
+                    following = self.next_stage(name)
+                    if following is None:
+                        finished += 1
+                        self._clean_work(name)
+                    else:
+                        waiting[following].append(name)
+                    log(f"[{finished}/{total}] {name}: {stage} {entry.get('rows', '?')} rows in {seconds:.1f}s")
+                    self._save_manifest()
+        finally:
+            threads.shutdown(cancel_futures=True)
+            processes.shutdown(cancel_futures=True)
+        return finished, failed, time.perf_counter() - started
+
+    def _schedule(self, waiting, active, processes, threads, public_context):
+        running = {stage: sum(1 for _, s in active.values() if s == stage) for stage in STAGES}
+        # Finishing files comes first; encrypting ahead is capped so
+        # ciphertexts don't pile up on disk while the server is the bottleneck
+        while waiting["decrypt"] and running["encrypt"] + running["decrypt"] < self.workers:
+            name = waiting["decrypt"].pop(0)
+            stem = os.path.join(self.out_dir, name)
+            active[processes.submit(_decrypt_job, self.predictions_path(name), stem, self.formats)] = (name, "decrypt")
+            running["decrypt"] += 1
+        while waiting["submit"] and running["submit"] < self.in_flight:
+            name = waiting["submit"].pop(0)
+            active[threads.submit(self._submit_job, name, public_context)] = (name, "submit")
+            running["submit"] += 1
+        while (waiting["encrypt"] and running["encrypt"] + running["decrypt"] < self.workers
+               and running["encrypt"] + len(waiting["submit"]) < self.in_flight + self.workers):
+            name = waiting["encrypt"].pop(0)
+            active[processes.submit(_encrypt_job, self.files[name]["input"], self.encrypted_path(name),
+                                    self.options)] = (name, "encrypt")
+            running["encrypt"] += 1
+
+    def _submit_job(self, name, public_context):
+        started = time.perf_counter()
+        rows = self.api.predict_container(self.encrypted_path(name), self.predictions_path(name), public_context,
+                                          chunk_rows=self.chunk_rows)
+        return {"rows": rows}, time.perf_counter() - started
+
+    def _clean_work(self, name):
+        if self.keep_work:
+            return
+        for path in (self.encrypted_path(name), self.predictions_path(name)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def report(self):
+        # Per-file stage times, in input order
+        lines = [f"{'file':<32} {'rows':>8} " + " ".join(f"{stage:>9}" for stage in STAGES)]
+        for name, entry in self.files.items():
+            seconds = [entry["seconds"].get(stage) for stage in STAGES]
+            lines.append(f"{name[:32]:<32} {entry.get('rows', '-'):>8} " +
+                         " ".join(f"{s:8.1f}s" if s is not None else f"{'-':>9}" for s in seconds))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encrypt, score and decrypt many CSVs against the PPML server")
+    parser.add_argument("inputs", nargs="+", help="directories of CSVs or glob patterns")
+    parser.add_argument("--out", default=OUTPUT_DIR,
+                        help="directory for <name>.csv predictions, work files and the run's batch.json")
+    parser.add_argument("--server", default=SERVER_URL, help="PPML server URL")
+    parser.add_argument("--encoding", choices=["row", "packed", "column"], default="column")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--features", choices=["expanded", "raw"], default="expanded")
+    parser.add_argument("--sigmoid", action="store_true", help="ask the server for encrypted probabilities")
+    parser.add_argument("--sigmoid-degree", type=int, default=None)
+    parser.add_argument("--models", nargs="+", default=None, metavar="VERSION",
+                        help="score with each of these model versions")
+    parser.add_argument("--ensemble", choices=["mean"], default=None)
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--format", nargs="+", choices=decrypt.OUTPUT_FORMATS, default=["csv"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes encrypting and decrypting files")
+    parser.add_argument("--in-flight", type=int, default=2, help="files being scored by the server at once")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="patient rows per scoring request")
+    parser.add_argument("--keep-work", action="store_true", help="keep each file's ciphertext containers")
+    parser.add_argument("--fresh", action="store_true", help="ignore the progress of an earlier run")
+    args = parser.parse_args()
+    if args.features == "raw" and args.encoding != "column":
+        parser.error("--features raw needs --encoding column")
+    if args.ensemble and not args.models:
+        parser.error("--ensemble needs --models")
+    if set(args.format) - {"csv"} and decrypt.pyarrow is None:
+        parser.error("parquet and arrow output need the `pyarrow` package (pip install pyarrow)")
+
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        parser.error("no CSV files found")
+    if args.fresh:
+        shutil.rmtree(os.path.join(args.out, WORK_NAME), ignore_errors=True)
+        if os.path.exists(os.path.join(args.out, MANIFEST_NAME)):
+            os.remove(os.path.join(args.out, MANIFEST_NAME))
+    os.makedirs(args.out, exist_ok=True)
+
+    # Load (or create) the keys once up front so the workers only read them
+    _, public_context = encrypt.load_context(args.encoding, get_profile(args.profile))
+
+    with PPMLClient(args.server, pool_size=args.in_flight * MAX_IN_FLIGHT + 2) as api:
+        # Normalize with the server's current model: download params.pkl, or
+        # revalidate the local copy by ETag
+        os.makedirs(os.path.dirname(encrypt.PARAMS_PATH), exist_ok=True)
+        try:
+            version = api.fetch_params(encrypt.PARAMS_PATH)
+        except (ServerError, OSError) as e:
+            if not os.path.exists(encrypt.PARAMS_PATH):
+                sys.exit(f"Can't fetch params.pkl from {args.server}: {e}")
+            print(f"Warning: can't revalidate params.pkl ({e}); using the local copy")
+        else:
+            if version is not None:
+                print(f"Downloaded params.pkl (model {version})")
+
+        # Work from an earlier run under other params is redone
+        with open(encrypt.PARAMS_PATH, "rb") as f:
+            params_hash = hashlib.sha256(f.read()).hexdigest()
+        options = {
+            "encoding": args.encoding, "profile": args.profile, "features": args.features,
+            "sigmoid": args.sigmoid, "sigmoid_degree": args.sigmoid_degree,
+            "models": args.models, "ensemble": args.ensemble, "compression": args.compression,
+            "params": params_hash
+        }
+        batch = BatchRun(inputs, args.out, api, options, args.format, args.workers, args.in_flight,
+                         args.chunk_rows, args.keep_work)
+        finished, failed, elapsed = batch.run(public_context)
+
+    print(batch.report())
+    busy = sum(sum(entry["seconds"].values()) for entry in batch.files.values())
+    print(f"{finished}/{len(inputs)} files done in {elapsed:.1f}s ({busy:.1f}s of stage work overlapped)")
+    if failed:
+        print(f"{len(failed)} failed; run the same command again to retry them")
+        sys.exit(1)
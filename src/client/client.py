@@ -2,22 +2,150 @@ import streamlit as st
 import pandas as pd
 import subprocess
 import os
-import requests
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
+import pickle
+import sys
+import io
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import framing
+from common.container import ContainerWriter
+from common.profiles import PROFILES, DEFAULT_PROFILE
+from api import PPMLClient
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 # --- Configuration ---
-SERVER_URL = "http://localhost:8000"
+SERVER_URL = os.environ.get("PPML_SERVER_URL", "http://localhost:8000")
 
 BASE_DIR            = os.path.dirname(__file__)
 USER_DATA_PATH      = os.path.join(BASE_DIR, "./data/user_data.csv")
-ENCRYPTED_DATA_PATH = os.path.join(BASE_DIR, "./data/encrypted_user_data.pkl")
-ENCRYPTED_PRED_PATH = os.path.join(BASE_DIR, "encrypted_predictions.pkl")
+ENCRYPTED_DATA_PATH = os.path.join(BASE_DIR, "./data/encrypted_user_data.ppmc")
+ENCRYPTED_PRED_PATH = os.path.join(BASE_DIR, "encrypted_predictions.ppmc")
 CONTEXT_PATH        = os.path.join(BASE_DIR, "./params/context_public.ckks")
 KEY_PATH            = os.path.join(BASE_DIR, "./params/context_private.ckks")
 CLIENT_PARAM        = os.path.join(BASE_DIR, "./params/params.pkl")
 PARAMS_PATH         = os.path.join(BASE_DIR, "../server/output/params.pkl")
 PRED_CSV_PATH       = os.path.join(BASE_DIR, "./data/predictions.csv")
+PRED_PARQUET_PATH   = os.path.join(BASE_DIR, "./data/predictions.parquet")
+JOB_POLL_INTERVAL   = 1.0
+# Result tables and plots are cached per version of the prediction and input
+# files, so widget clicks don't redo them; plots of large result sets are
+# drawn from a sample and the table shows its first rows
+PLOT_SAMPLE_ROWS    = 5000
+TABLE_ROWS          = 1000
+
+@st.cache_resource
+def get_api():
+    # One pooled client per app process, so reruns reuse its connections
+    return PPMLClient(SERVER_URL)
+
+def load_predictions():
+    # Prefer the Parquet copy decrypt.py writes next to the CSV: typed columns,
+    # no text parsing. Fall back to the CSV when it is missing or stale
+    if pyarrow is not None and os.path.exists(PRED_PARQUET_PATH) \
+            and os.path.getmtime(PRED_PARQUET_PATH) >= os.path.getmtime(PRED_CSV_PATH):
+        return pd.read_parquet(PRED_PARQUET_PATH)
+    return pd.read_csv(PRED_CSV_PATH)
+
+def file_version(*paths):
+    # Cache key that changes whenever one of the files is rewritten
+    version = []
+    for path in paths:
+        stat = os.stat(path) if os.path.exists(path) else None
+        version.append((path, stat.st_mtime_ns, stat.st_size) if stat else (path, None))
+    return tuple(version)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_results(version):
+    # Input rows joined with their predictions; shared between reruns, not copied
+    predictions_df = load_predictions()
+    user_df = pd.read_csv(USER_DATA_PATH)
+    if "Outcome" in user_df.columns:
+        user_df = user_df.drop(columns=["Outcome"])
+
+    user_df["Prediction"] = predictions_df["Prediction"]
+    user_df["Score"] = predictions_df["Score"]
+    # Per-model columns of a multi-model result
+    for column in predictions_df.columns:
+        if column.startswith(("Prediction_", "Score_")):
+            user_df[column] = predictions_df[column]
+    return user_df
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def result_stats(version):
+    user_df = load_results(version)
+    return {
+        "counts": user_df["Prediction"].value_counts().reindex([0, 1], fill_value=0).tolist(),
+        "corr": user_df.select_dtypes(include=np.number).corr(),
+        "describe": user_df.groupby("Prediction").describe()
+    }
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def results_csv(version):
+    return load_results(version).to_csv(index=False).encode("utf-8")
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def plot_sample(version):
+    user_df = load_results(version)
+    if len(user_df) <= PLOT_SAMPLE_ROWS:
+        return user_df
+    return user_df.sample(n=PLOT_SAMPLE_ROWS, random_state=0)
+
+def figure_png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def render_plot(version, kind, feature=None):
+    # Rendered PNG of one of the result plots
+    if kind == "pie":
+        fig, ax = plt.subplots(figsize=(4.5, 4.5))
+        ax.pie(
+            result_stats(version)["counts"],
+            labels=["Non-diabetic", "Diabetic"],
+            autopct="%1.1f%%",
+            startangle=90,
+            colors=["#3498db", "#e74c3c"]
+        )
+        ax.axis("equal")
+        ax.set_title("Prediction Breakdown", fontsize=10)
+    elif kind == "scores":
+        fig, ax = plt.subplots(figsize=(5.5, 3.5))
+        sns.histplot(plot_sample(version)["Score"], bins=20, kde=True, ax=ax)
+        ax.axvline(x=0.5, color='r', linestyle='--', label='Threshold')
+        ax.set_title("Score Distribution", fontsize=10)
+        ax.legend()
+    elif kind == "corr":
+        fig, ax = plt.subplots(figsize=(7.5, 6.5))
+        corr = result_stats(version)["corr"]
+        mask = np.triu(np.ones_like(corr, dtype=bool))
+        sns.heatmap(corr, mask=mask, annot=True, fmt=".2f", cmap="coolwarm", ax=ax)
+        ax.set_title("Correlation Heatmap", fontsize=12)
+    elif kind == "box":
+        fig, ax = plt.subplots(figsize=(6, 4))
+        sns.boxplot(data=plot_sample(version), x="Prediction", y=feature, ax=ax)
+        ax.set_title(f"{feature} by Prediction", fontsize=11)
+    else:
+        fig, ax = plt.subplots(figsize=(6, 4))
+        sns.histplot(data=plot_sample(version), x=feature, hue="Prediction", kde=True, multiple="dodge", ax=ax)
+        ax.set_title(f"{feature} Distribution by Prediction", fontsize=11)
+    return figure_png(fig)
+
+def server_models():
+    # Registered model versions, for scoring several in one request
+    try:
+        return get_api().models()["versions"]
+    except Exception:
+        return []
+
 
 # Ensure folders exist
 os.makedirs(os.path.join(BASE_DIR, "data"), exist_ok=True)
@@ -28,7 +156,7 @@ st.title("🛡️ PPML Client: Encrypt, Submit & Decrypt")
 
 st.sidebar.markdown("""
 ### 🔐 Workflow:
-1. Upload raw CSV or encrypted `.pkl`  
+1. Upload raw CSV or encrypted `.ppmc` / `.pkl`  
 2. Upload `params.pkl` (downloaded from server)  
 3. Encrypt data (if CSV)  
 4. Submit for encrypted inference  
@@ -40,22 +168,19 @@ st.sidebar.markdown("### 📥 Download Model Parameters")
 if os.path.exists(PARAMS_PATH):
     with open(PARAMS_PATH, "rb") as f:
         st.sidebar.download_button("Download params.pkl", f.read(), "params.pkl")
-else:
-    if st.sidebar.button("Fetch params.pkl from server"):
-        try:
-            r = requests.get(SERVER_URL + "/params", timeout=5)
-            if r.status_code == 200:
-                with open(PARAMS_PATH, "wb") as f:
-                    f.write(r.content)
-                st.sidebar.success("params.pkl downloaded.")
-            else:
-                st.sidebar.error(f"Server error: {r.status_code}")
-        except Exception as e:
-            st.sidebar.error(f"Download error: {e}")
+if st.sidebar.button("Fetch params.pkl from server"):
+    try:
+        version = get_api().fetch_params(CLIENT_PARAM)
+        if version is None:
+            st.sidebar.success("params.pkl is up to date.")
+        else:
+            st.sidebar.success(f"params.pkl downloaded (model {version}).")
+    except Exception as e:
+        st.sidebar.error(f"Download error: {e}")
 
 
 # Step 1: Upload CSV or Encrypted PKL
-uploaded_file = st.file_uploader("Upload your CSV or Encrypted PKL", type=["csv", "pkl"])
+uploaded_file = st.file_uploader("Upload your CSV or encrypted container", type=["csv", "ppmc", "pkl"])
 
 if uploaded_file:
     if uploaded_file.name.endswith(".csv"):
@@ -75,125 +200,177 @@ if uploaded_file:
                 st.success("✅ `params.pkl` uploaded and saved.")
 
         # Step 3: Encrypt the CSV
+        encoding = st.radio(
+            "Ciphertext layout",
+            ["row", "packed", "column"],
+            horizontal=True,
+            help="`packed` puts many patients into each ciphertext for much smaller uploads; "
+                 "`column` encrypts each feature across patients, fastest for large cohorts."
+        )
+        profile = st.radio(
+            "CKKS profile",
+            list(PROFILES),
+            index=list(PROFILES).index(DEFAULT_PROFILE),
+            horizontal=True,
+            help="`fast` uses the smallest keys and ciphertexts at ~3e-4 score precision; "
+                 "`deep` leaves room for polynomial activations."
+        )
+        raw_features = st.checkbox(
+            "Let the server expand features (smaller upload)",
+            value=False,
+            disabled=encoding != "column" or profile not in ("standard", "deep"),
+            help="Encrypts only the 8 normalized inputs; the server computes the polynomial terms "
+                 "homomorphically. Needs the `column` layout and the `standard` or `deep` profile."
+        )
+        # Raw features and the sigmoid together need depth 5, more than any profile has
+        sigmoid = st.checkbox(
+            "Server returns probabilities (encrypted sigmoid)",
+            value=False,
+            disabled=profile != "deep" or raw_features,
+            help="The server evaluates a sigmoid polynomial on the encrypted scores; needs the `deep` "
+                 "profile and doesn't combine with server-side feature expansion."
+        )
+        compare = st.multiselect(
+            "Score with several model versions",
+            server_models(),
+            help="The server scores every selected version in one pass over the ciphertexts; "
+                 "the results get a Prediction/Score column per model."
+        )
+        ensemble = st.checkbox("Add their averaged (ensemble) score", value=False, disabled=len(compare) < 2)
         if os.path.exists(CLIENT_PARAM) and st.button("🔐 Encrypt CSV"):
+            enc_args = ["python", "encrypt.py", "--encoding", encoding, "--profile", profile]
+            if raw_features and encoding == "column" and profile in ("standard", "deep"):
+                enc_args += ["--features", "raw"]
+            if sigmoid and profile == "deep" and not raw_features:
+                enc_args.append("--sigmoid")
+            if compare:
+                enc_args += ["--models", *compare]
+                if ensemble and len(compare) > 1:
+                    enc_args += ["--ensemble", "mean"]
             with st.spinner("Encrypting..."):
-                enc_proc = subprocess.run(["python", "encrypt.py"], capture_output=True, text=True)
+                enc_proc = subprocess.run(enc_args, capture_output=True, text=True)
             if enc_proc.returncode != 0:
                 st.error("Encryption failed:")
                 st.code(enc_proc.stderr)
             else:
-                st.success("Encrypted to `encrypted_user_data.pkl`")
+                st.success("Encrypted to `encrypted_user_data.ppmc`")
 
-    elif uploaded_file.name.endswith(".pkl"):
+    elif uploaded_file.name.endswith(".ppmc"):
         with open(ENCRYPTED_DATA_PATH, "wb") as f:
             f.write(uploaded_file.getbuffer())
-        st.success("Encrypted PKL saved to `encrypted_user_data.pkl`")
+        st.success("Encrypted container saved to `encrypted_user_data.ppmc`")
+
+    elif uploaded_file.name.endswith(".pkl"):
+        # Convert legacy pickled batches into a container
+        header, units = framing.batch_units(pickle.loads(uploaded_file.getbuffer()))
+        with open(ENCRYPTED_DATA_PATH, "wb") as f:
+            with ContainerWriter(f, encoding=header["encoding"], parts_per_unit=header["parts_per_unit"]) as writer:
+                for rows, parts in units:
+                    writer.add_unit(rows, parts)
+        st.success("Encrypted PKL converted to `encrypted_user_data.ppmc`")
 
 # Step 4: Submit to Server
 if os.path.exists(ENCRYPTED_DATA_PATH) and os.path.exists(CONTEXT_PATH):
     if st.button("🔄 Submit for Inference"):
-        with st.spinner("Sending encrypted data..."):
-            with open(ENCRYPTED_DATA_PATH, "rb") as f_data, open(CONTEXT_PATH, "rb") as f_ctx:
-                files = {
-                    "encrypted": ("encrypted_user_data.pkl", f_data, "application/octet-stream"),
-                    "context": ("context_public.ckks", f_ctx, "application/octet-stream")
-                }
-                resp = requests.post(SERVER_URL + "/predict/", files=files)
-
-        if resp.status_code == 200:
-            with open(ENCRYPTED_PRED_PATH, "wb") as f:
-                f.write(resp.content)
+        with open(CONTEXT_PATH, "rb") as f_ctx:
+            context_bytes = f_ctx.read()
+        # Sent as concurrent chunk streams over pooled connections; failed
+        # chunks are retried, and pressing the button again after an error
+        # only sends the chunks still missing
+        progress = st.progress(0.0, text="Sending encrypted data...")
+        try:
+            get_api().predict_container(
+                ENCRYPTED_DATA_PATH, ENCRYPTED_PRED_PATH, context_bytes,
+                progress=lambda done, total: progress.progress(min(done / max(total, 1), 1.0),
+                                                               text=f"Received {done}/{total} predictions")
+            )
             st.success("✅ Encrypted predictions received.")
-        else:
-            st.error(f"Server error {resp.status_code}:")
-            st.code(resp.text)
+        except Exception as e:
+            st.error(f"Inference failed: {e}")
+
+    # Large batches: submit a job and poll instead of holding the request open
+    if st.button("🕒 Submit as Background Job"):
+        api = get_api()
+        try:
+            with open(CONTEXT_PATH, "rb") as f_ctx:
+                context_key = api.ensure_context(f_ctx.read())
+            job = api.submit_job(ENCRYPTED_DATA_PATH, context_key)
+            progress = st.progress(0.0, text=f"Job {job['job_id']} queued")
+            job = api.wait_job(
+                job["job_id"],
+                lambda job: progress.progress(min(job["rows_done"] / max(job["rows_total"], 1), 1.0),
+                                              text=f"Job {job['status']}: {job['rows_done']}/{job['rows_total']} rows"),
+                JOB_POLL_INTERVAL
+            )
+            if job["status"] == "done":
+                api.download_job(job["job_id"], ENCRYPTED_PRED_PATH)
+                st.success("✅ Encrypted predictions received.")
+            else:
+                st.error(f"Job failed: {job['error']}")
+        except Exception as e:
+            st.error(f"Job submission failed: {e}")
 
 # Step 5: Decrypt
 if os.path.exists(ENCRYPTED_PRED_PATH) and st.button("🧩 Decrypt Predictions"):
     with st.spinner("Decrypting..."):
-        dec_proc = subprocess.run(["python", "decrypt.py"], capture_output=True, text=True)
+        formats = ["csv", "parquet"] if pyarrow is not None else ["csv"]
+        dec_proc = subprocess.run(["python", "decrypt.py", "--format", *formats], capture_output=True, text=True)
     if dec_proc.returncode != 0:
         st.error("Decryption failed:")
         st.code(dec_proc.stderr)
     else:
         st.success("✅ Decryption complete!")
-        preds = pd.read_csv(PRED_CSV_PATH)
         st.subheader("📊 Prediction Results")
 
 if os.path.exists(PRED_CSV_PATH) and os.path.exists(USER_DATA_PATH):
-    predictions_df = pd.read_csv(PRED_CSV_PATH)
-    user_df = pd.read_csv(USER_DATA_PATH)
-    if "Outcome" in user_df.columns:
-        user_df = user_df.drop(columns=["Outcome"])
-
-    user_df["Prediction"] = predictions_df["Prediction"]
-    user_df["Score"] = predictions_df["Score"]
+    version = file_version(PRED_CSV_PATH, PRED_PARQUET_PATH, USER_DATA_PATH)
+    user_df = load_results(version)
+    stats = result_stats(version)
 
     st.subheader("🔍 Prediction Results")
-    st.metric("Non-diabetic (0)", (user_df["Prediction"] == 0).sum())
-    st.metric("Diabetic (1)", (user_df["Prediction"] == 1).sum())
+    st.metric("Non-diabetic (0)", stats["counts"][0])
+    st.metric("Diabetic (1)", stats["counts"][1])
 
     st.subheader("📋 Data with Predictions")
-    st.dataframe(user_df)
+    st.dataframe(user_df.head(TABLE_ROWS))
+    if len(user_df) > TABLE_ROWS:
+        st.caption(f"First {TABLE_ROWS} of {len(user_df)} rows; download the CSV for all of them.")
 
     st.download_button(
         label="Download predictions.csv",
-        data=user_df.to_csv(index=False),
+        data=results_csv(version),
         file_name="predictions.csv",
         mime="text/csv"
     )
 
     # Visualization Tabs
     st.subheader("📊 Visualizations")
+    if len(user_df) > PLOT_SAMPLE_ROWS:
+        st.caption(f"Distributions are drawn from a random sample of {PLOT_SAMPLE_ROWS} rows; "
+                   "counts, correlations and statistics use all of them.")
     tab1, tab2, tab3 = st.tabs(["Prediction Distribution", "Feature Correlations", "Feature Analysis"])
 
     with tab1:
         col1, col2 = st.columns(2)
 
         with col1:
-            fig1, ax1 = plt.subplots(figsize=(4.5, 4.5))
-            ax1.pie(
-                [(user_df["Prediction"] == 0).sum(), (user_df["Prediction"] == 1).sum()],
-                labels=["Non-diabetic", "Diabetic"],
-                autopct="%1.1f%%",
-                startangle=90,
-                colors=["#3498db", "#e74c3c"]
-            )
-            ax1.axis("equal")
-            ax1.set_title("Prediction Breakdown", fontsize=10)
-            st.pyplot(fig1)
+            st.image(render_plot(version, "pie"))
 
         with col2:
-            fig2, ax2 = plt.subplots(figsize=(5.5, 3.5))
-            sns.histplot(user_df["Score"], bins=20, kde=True, ax=ax2)
-            ax2.axvline(x=0.5, color='r', linestyle='--', label='Threshold')
-            ax2.set_title("Score Distribution", fontsize=10)
-            ax2.legend()
-            st.pyplot(fig2)
+            st.image(render_plot(version, "scores"))
 
     with tab2:
-        fig3, ax3 = plt.subplots(figsize=(7.5, 6.5))
-        corr = user_df.select_dtypes(include=np.number).corr()
-        mask = np.triu(np.ones_like(corr, dtype=bool))
-        sns.heatmap(corr, mask=mask, annot=True, fmt=".2f", cmap="coolwarm", ax=ax3)
-        ax3.set_title("Correlation Heatmap", fontsize=12)
-        st.pyplot(fig3)
+        st.image(render_plot(version, "corr"))
 
     with tab3:
-        feature = st.selectbox("Select a feature:", [col for col in user_df.columns if col not in ["Prediction", "Score"]])
-
-        fig4, ax4 = plt.subplots(figsize=(6, 4))
-        sns.boxplot(data=user_df, x="Prediction", y=feature, ax=ax4)
-        ax4.set_title(f"{feature} by Prediction", fontsize=11)
-        st.pyplot(fig4)
+        feature = st.selectbox("Select a feature:", [col for col in user_df.columns
+                                                     if not col.startswith(("Prediction", "Score"))])
 
-        fig5, ax5 = plt.subplots(figsize=(6, 4))
-        sns.histplot(data=user_df, x=feature, hue="Prediction", kde=True, multiple="dodge", ax=ax5)
-        ax5.set_title(f"{feature} Distribution by Prediction", fontsize=11)
-        st.pyplot(fig5)
+        st.image(render_plot(version, "box", feature))
+        st.image(render_plot(version, "hist", feature))
 
         if st.checkbox("Show descriptive statistics"):
-            st.write(user_df.groupby("Prediction")[feature].describe())
+            st.write(stats["describe"][feature])
 
 # --- Reset Demo Button ---
 st.sidebar.markdown("---")
@@ -1,48 +1,322 @@
 import tenseal as ts
+import numpy as np
+import pandas as pd
 import pickle
-import csv
 import os
-import numpy as np
+import sys
+import argparse
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.container import ContainerReader, is_container, parse_row_range
+from common.metrics import StageTimer, NULL_TIMER, timed
+from keystore import KeyStore
 
-# Load encryption context
-with open("./params/context_private.ckks", "rb") as f:
-    context = ts.context_from(f.read())
-
-# Load all encrypted predictions from batch .pkl file
-with open("encrypted_predictions.pkl", "rb") as f:
-    encrypted_preds = pickle.load(f)
-
-scores = []
-for idx, pred_bytes in enumerate(encrypted_preds):
-    try:
-        enc_pred = ts.ckks_vector_from(context, pred_bytes)
-        val = enc_pred.decrypt()[0]
-        scores.append(val)
-    except Exception as e:
-        # Log or print and skip corrupted entries
-        print(f"Warning: failed to decrypt prediction #{idx}: {e}")
-        continue
+SECRET_CONTEXT_PATH     = "./params/context_private.ckks"
+PREDICTIONS_PATH        = "encrypted_predictions.ppmc"
+LEGACY_PREDICTIONS_PATH = "encrypted_predictions.pkl"
+PRED_CSV_PATH           = "./data/predictions.csv"
+# Columnar copies for the Streamlit client and downstream tools (need pyarrow)
+PRED_PARQUET_PATH       = "./data/predictions.parquet"
+PRED_ARROW_PATH         = "./data/predictions.arrow"
+OUTPUT_FORMATS          = ("csv", "parquet", "arrow")
+# Prediction ciphertexts handed to a decryption worker at a time
+DECRYPT_BATCH           = 256
 
 # Apply a small epsilon to counteract CKKS rounding noise
-eps = 1e-6
-labels = [1 if s > 0.5 + eps else 0 for s in scores]
-
-# Compute class counts and overall metrics
-zero_count = labels.count(0)
-one_count  = labels.count(1)
-total      = len(labels)
-accuracy   = (np.array(labels) == np.array([int(l) for l in labels])).mean()  # same list comparison
-
-print("Decrypted Predictions Summary:")
-print(f"Total 0s: {zero_count}")
-print(f"Total 1s: {one_count}")
-
-# Save to CSV for frontend use
-os.makedirs("./data", exist_ok=True)
-with open("./data/predictions.csv", "w", newline="") as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(["Prediction", "Score"])
-    for lbl, sc in zip(labels, scores):
-        writer.writerow([lbl, round(sc, 4)])
-
-print(f"Saved predictions.csv ({total} records)")
+EPS = 1e-6
+
+
+def load_context(path=SECRET_CONTEXT_PATH):
+    # Load encryption context
+    with open(path, "rb") as f:
+        return ts.context_from(f.read())
+
+
+def prediction_header(predictions_path=PREDICTIONS_PATH):
+    # Header of the prediction container, empty for legacy .pkl results
+    if os.path.exists(predictions_path) and is_container(predictions_path):
+        with ContainerReader(predictions_path) as reader:
+            return reader.header
+    return {}
+
+
+def secret_context_path(header):
+    # Prefer the stored key set the predictions were made under, so results
+    # from an earlier key set still decrypt after encrypting with another one
+    fp = header.get("context_hash")
+    path = KeyStore().secret_context_path(fp) if fp else None
+    return path if path is not None else SECRET_CONTEXT_PATH
+
+
+def to_probabilities(scores, activation=None):
+    if activation == "sigmoid":
+        # Already probabilities; the server's polynomial can overshoot [0, 1]
+        # slightly for scores outside its fit range
+        return np.clip(np.asarray(scores, dtype=np.float64), 0.0, 1.0)
+    # Raw logistic regression scores: apply the sigmoid here (tanh form, no overflow)
+    return 0.5 * (1 + np.tanh(np.asarray(scores, dtype=np.float64) / 2))
+
+
+def iter_container_predictions(path, rows=None):
+    # Yield (prediction parts, rows they cover, rows to skip, rows to keep) from
+    # the mmapped container, touching only the units in the requested row
+    # range. Multi-model results hold one part per model
+    with ContainerReader(path) as reader:
+        units, unit_start = None, 0
+        start, stop = 0, reader.row_count
+        if rows is not None:
+            start = rows[0]
+            stop = reader.row_count if rows[1] is None else min(rows[1], reader.row_count)
+            units, unit_start = reader.units_for_rows(start, stop)
+        for n, parts in reader.iter_units(units):
+            # Trim the first and last unit to the requested rows
+            skip = max(start - unit_start, 0)
+            take = min(n, stop - unit_start) - skip
+            yield parts, n, skip, take
+            unit_start += n
+
+
+def iter_legacy_predictions(path):
+    # Batch .pkl files from older clients
+    with open(path, "rb") as f:
+        encrypted_preds = pickle.load(f)
+    if isinstance(encrypted_preds, dict) and encrypted_preds.get("encoding") in ("packed", "column"):
+        # Each packed or column prediction holds the scores of `n` rows in its first slots
+        for pred_bytes, n in zip(encrypted_preds["ciphertexts"], encrypted_preds["rows"]):
+            yield [pred_bytes], n, 0, n
+        return
+    if isinstance(encrypted_preds, dict):
+        encrypted_preds = encrypted_preds["ciphertexts"]
+    for pred_bytes in encrypted_preds:
+        yield [pred_bytes], 1, 0, 1
+
+
+def iter_encrypted_predictions(rows=None, path=PREDICTIONS_PATH, legacy_path=LEGACY_PREDICTIONS_PATH):
+    if os.path.exists(path) and is_container(path):
+        return iter_container_predictions(path, rows)
+    return iter_legacy_predictions(legacy_path)
+
+
+def _decrypt_batch(context, batch, first_idx=0, timer=NULL_TIMER):
+    # Decrypt (prediction parts, skip, take) entries into one (rows, parts)
+    # array; a corrupted entry becomes NaN rows so later rows keep their positions
+    blocks = []
+    for idx, (pred_parts, skip, take) in enumerate(batch, first_idx):
+        try:
+            columns = []
+            for pred_bytes in pred_parts:
+                with timer.stage("parse"):
+                    pred = ts.ckks_vector_from(context, pred_bytes)
+                with timer.stage("decrypt"):
+                    columns.append(pred.decrypt()[skip:skip + take])
+            blocks.append(np.asarray(columns, dtype=np.float64).T)
+        except Exception as e:
+            print(f"Warning: failed to decrypt prediction #{idx}: {e}")
+            blocks.append(np.full((take, len(pred_parts)), np.nan))
+    return np.concatenate(blocks) if blocks else np.empty((0, 1))
+
+
+def _iter_batches(encrypted_preds, size):
+    batch = []
+    for pred_parts, _, skip, take in encrypted_preds:
+        batch.append((pred_parts, skip, take))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Pool worker state ---
+_worker_context = None
+
+
+def _init_worker(context_bytes):
+    global _worker_context
+    _worker_context = ts.context_from(context_bytes)
+
+
+def _decrypt_worker(batch, first_idx):
+    return _decrypt_batch(_worker_context, batch, first_idx)
+
+
+def _join_scores(blocks):
+    # One score per row, or a column per model for multi-model results
+    scores = np.concatenate(blocks) if blocks else np.empty((0, 1))
+    return scores[:, 0] if scores.shape[1] == 1 else scores
+
+
+def decrypt_scores(context, encrypted_preds, workers=1, batch_size=DECRYPT_BATCH, timer=NULL_TIMER):
+    # Decrypt every prediction into one float64 array, in order. Batches of
+    # ciphertexts go to a worker pool when workers > 1, keeping a bounded
+    # number in flight so the whole result set is never held as ciphertexts.
+    # With a pool, "decrypt" is the time spent waiting on the workers
+    batches = _iter_batches(timed(encrypted_preds, timer, "read"), batch_size)
+    if workers <= 1:
+        parts, first_idx = [], 0
+        for batch in batches:
+            parts.append(_decrypt_batch(context, batch, first_idx, timer))
+            first_idx += len(batch)
+        return _join_scores(parts)
+
+    context_bytes = context.serialize(save_secret_key=True, save_galois_keys=False, save_relin_keys=False)
+    parts, pending, first_idx = [], deque(), 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(context_bytes,)
+    ) as pool:
+        for batch in batches:
+            pending.append(pool.submit(_decrypt_worker, batch, first_idx))
+            first_idx += len(batch)
+            if len(pending) >= 2 * workers:
+                with timer.stage("decrypt"):
+                    parts.append(pending.popleft().result())
+        while pending:
+            with timer.stage("decrypt"):
+                parts.append(pending.popleft().result())
+    return _join_scores(parts)
+
+
+def label_scores(scores):
+    # Masked int8 labels: rows that failed to decrypt (NaN scores) stay
+    # masked, so they are written as NA and left out of the counts
+    scores = np.asarray(scores)
+    return np.ma.masked_array((scores > 0.5 + EPS).astype(np.int8), mask=np.isnan(scores))
+
+
+def label_column(labels):
+    # Nullable pandas column of (masked) labels
+    labels = np.ma.asarray(labels)
+    return pd.arrays.IntegerArray(labels.filled(0).astype(np.int8), np.ma.getmaskarray(labels))
+
+
+def primary_output(outputs):
+    # Column of a multi-model result that Prediction and Score follow: the
+    # ensemble if one was requested, else the first model
+    return outputs.index("mean") if "mean" in outputs else 0
+
+
+def predictions_frame(labels, scores, outputs=None):
+    if not outputs:
+        return pd.DataFrame({"Prediction": label_column(labels), "Score": scores})
+    primary = primary_output(outputs)
+    columns = {"Prediction": label_column(labels[:, primary]), "Score": scores[:, primary]}
+    for i, name in enumerate(outputs):
+        columns[f"Prediction_{name}"] = label_column(labels[:, i])
+        columns[f"Score_{name}"] = scores[:, i]
+    return pd.DataFrame(columns)
+
+
+def write_predictions_csv(labels, scores, path=PRED_CSV_PATH, outputs=None):
+    # Save to CSV for frontend use
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    predictions_frame(labels, np.round(scores, 4), outputs).to_csv(path, index=False)
+
+
+def output_path(fmt, stem=None):
+    # Where a format is written: the fixed paths the Streamlit client reads,
+    # or `stem` plus the format's extension
+    if stem is None:
+        return {"csv": PRED_CSV_PATH, "parquet": PRED_PARQUET_PATH, "arrow": PRED_ARROW_PATH}[fmt]
+    return f"{stem}.{fmt}"
+
+
+def write_predictions(labels, scores, formats=("csv",), outputs=None, stem=None):
+    # Write each requested format; the columnar ones keep full precision.
+    # Multi-model results get a Prediction_/Score_ column pair per model
+    df = predictions_frame(labels, scores, outputs)
+    paths = []
+    for fmt in formats:
+        path = output_path(fmt, stem)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if fmt == "csv":
+            write_predictions_csv(labels, scores, path, outputs)
+        elif fmt == "parquet":
+            df.to_parquet(path, index=False)
+        elif fmt == "arrow":
+            df.to_feather(path)
+        paths.append(path)
+    return paths
+
+
+def decrypt_file(predictions_path=PREDICTIONS_PATH, legacy_path=LEGACY_PREDICTIONS_PATH, stem=None, rows=None,
+                 formats=("csv",), workers=1, timer=NULL_TIMER):
+    # Decrypt a prediction container (or legacy .pkl) and write the requested
+    # formats. Returns a summary: rows, negative and positive labels
+    # (positives per model for multi-model results), rows that failed to
+    # decrypt, the scoring model and the files written
+    header = prediction_header(predictions_path)
+    with timer.stage("context"):
+        context = load_context(secret_context_path(header))
+    scores = decrypt_scores(context, iter_encrypted_predictions(rows, predictions_path, legacy_path),
+                            workers=workers, timer=timer)
+    with timer.stage("labels"):
+        scores = to_probabilities(scores, header.get("activation"))
+        labels = label_scores(scores)
+
+    outputs = header.get("outputs")
+    if outputs and scores.ndim == 1:
+        # A single-output result keeps its model's name
+        scores, labels = scores[:, None], labels[:, None]
+    primary = labels[:, primary_output(outputs)] if outputs else labels
+
+    with timer.stage("write"):
+        paths = write_predictions(labels, scores, formats, outputs, stem)
+    return {
+        "rows": len(labels),
+        "zeros": int((primary == 0).filled(False).sum()),
+        "ones": int((primary == 1).filled(False).sum()),
+        "failed": int(np.ma.getmaskarray(primary).sum()),
+        "model_version": header.get("model_version"),
+        "outputs": {name: int((labels[:, i] == 1).filled(False).sum()) for i, name in enumerate(outputs or [])},
+        "paths": paths
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decrypt encrypted_predictions.ppmc into ./data/predictions.csv")
+    parser.add_argument("--rows", type=parse_row_range, default=None,
+                        help="only decrypt patient rows start:stop of the prediction container")
+    parser.add_argument("--format", nargs="+", choices=OUTPUT_FORMATS, default=["csv"],
+                        help="outputs to write next to each other (parquet and arrow need pyarrow)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="decryption processes, worth it for large row-encoded result sets")
+    parser.add_argument("--timings", action="store_true", help="print a per-stage timing breakdown")
+    args = parser.parse_args()
+    if set(args.format) - {"csv"} and pyarrow is None:
+        parser.error("parquet and arrow output need the `pyarrow` package (pip install pyarrow)")
+
+    started = time.perf_counter()
+    timer = StageTimer() if args.timings else NULL_TIMER
+    summary = decrypt_file(rows=args.rows, formats=args.format, workers=args.workers, timer=timer)
+
+    # Compute class counts and overall metrics
+    one_count  = summary["ones"]
+    total      = summary["rows"]
+    zero_count = summary["zeros"]
+
+    print("Decrypted Predictions Summary:")
+    print(f"Total 0s: {zero_count}")
+    print(f"Total 1s: {one_count}")
+    if summary["failed"]:
+        print(f"Failed to decrypt: {summary['failed']} (left without a label)")
+    if summary["model_version"]:
+        print(f"Scored by model {summary['model_version']}")
+    for name, ones in summary["outputs"].items():
+        print(f"  {name}: {ones} 1s")
+
+    for path in summary["paths"]:
+        print(f"Saved {path} ({total} records)")
+    if args.timings:
+        print(timer.report(time.perf_counter() - started))
@@ -2,55 +2,309 @@ import tenseal as ts
 import pandas as pd
 import pickle
 import os
-import numpy as np
-
-# Load model bundle
-os.makedirs("./params", exist_ok=True)
-with open("./params/params.pkl", "rb") as f:
-    param = pickle.load(f)
-
-mean = param["mean"]
-std = param["std"]
-poly = param["poly"]
-
-# Load input user data
-input_path = "./data/user_data.csv"
-df = pd.read_csv(input_path)
-if "Outcome" in df.columns:
-    df = df.drop(columns=["Outcome"])
-data = df.values
-
-# Normalize data
-normalized_data = (data - mean) / std
-
-# Apply polynomial transformation
-X_poly = poly.transform(normalized_data)
-
-# Create encryption context
-context = ts.context(
-    ts.SCHEME_TYPE.CKKS,
-    poly_modulus_degree=8192,
-    coeff_mod_bit_sizes=[60, 40, 40, 60]
-)
-context.global_scale = 2**40
-context.generate_galois_keys()
-
-# Save context
-with open("params/context_public.ckks", "wb") as f:
-    f.write(context.serialize())
-
-# Save key
-with open("./params/context_private.ckks", "wb") as f:
-    f.write(context.serialize(save_secret_key=True))
-
-# Encrypt each row and collect into a batch
-batch_encrypted = []
-for row in X_poly:
-    enc_vec = ts.ckks_vector(context, row)
-    batch_encrypted.append(enc_vec.serialize())
-
-# Save batch to a binary file using pickle
-with open("./data/encrypted_user_data.pkl", "wb") as f:
-    pickle.dump(batch_encrypted, f)
-
-print(f"Encrypted and saved {len(batch_encrypted)} vectors to ./data/encrypted_user_data.pkl")
+import sys
+import argparse
+import hashlib
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.container import ContainerWriter, COMPRESSIONS
+from common.profiles import PROFILES, DEFAULT_PROFILE, get_profile, header_fields
+from common.metrics import StageTimer, NULL_TIMER, timed
+from keystore import KeyStore, key_id, needs_galois_keys
+
+# Defaults come from the default CKKS profile; --profile picks another
+_DEFAULT            = get_profile(DEFAULT_PROFILE)
+POLY_MODULUS_DEGREE = _DEFAULT["poly_modulus_degree"]
+COEFF_MOD_BIT_SIZES = _DEFAULT["coeff_mod_bit_sizes"]
+GLOBAL_SCALE        = _DEFAULT["global_scale"]
+
+PARAMS_PATH         = "./params/params.pkl"
+INPUT_PATH          = "./data/user_data.csv"
+PUBLIC_CONTEXT_PATH = "./params/context_public.ckks"
+SECRET_CONTEXT_PATH = "./params/context_private.ckks"
+OUTPUT_PATH         = "./data/encrypted_user_data.ppmc"
+# CSV rows read, normalized and expanded per chunk
+CHUNK_ROWS          = 1024
+
+
+def load_params(path=PARAMS_PATH):
+    # Load model bundle
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def prepare_features(df, param, expand=True):
+    # Drop the label if present, normalize and apply the polynomial
+    # transformation (unless the server expands raw features itself)
+    if "Outcome" in df.columns:
+        df = df.drop(columns=["Outcome"])
+    normalized_data = (df.values - param["mean"]) / param["std"]
+    return param["poly"].transform(normalized_data) if expand else normalized_data
+
+
+def create_context(poly_modulus_degree=POLY_MODULUS_DEGREE, coeff_mod_bit_sizes=COEFF_MOD_BIT_SIZES,
+                   global_scale=GLOBAL_SCALE, galois_keys=True):
+    # Create encryption context
+    context = ts.context(
+        ts.SCHEME_TYPE.CKKS,
+        poly_modulus_degree=poly_modulus_degree,
+        coeff_mod_bit_sizes=list(coeff_mod_bit_sizes)
+    )
+    context.global_scale = global_scale
+    if galois_keys:
+        context.generate_galois_keys()
+    return context
+
+
+def load_context(encoding, profile=_DEFAULT, regenerate=False, store=None, activate=True):
+    # Reuse the stored keys for this profile, generating them only the first
+    # time; Galois keys are only made for kernels that rotate. activate=False
+    # leaves the fixed context paths alone (e.g. in concurrent batch workers)
+    store = store or KeyStore()
+    galois_keys = needs_galois_keys(encoding)
+    params = (profile["poly_modulus_degree"], profile["coeff_mod_bit_sizes"], profile["global_scale"])
+    context, public_context, fp = store.load_or_create(
+        key_id(*params, galois_keys),
+        lambda: create_context(*params, galois_keys),
+        regenerate=regenerate
+    )
+    # Keep the fixed paths decrypt.py and the client upload read in sync
+    if activate:
+        store.activate(fp, PUBLIC_CONTEXT_PATH, SECRET_CONTEXT_PATH)
+    return context, public_context
+
+
+def encrypt_units(context, X_poly, encoding, poly_modulus_degree=POLY_MODULUS_DEGREE):
+    # Yield (rows, serialized ciphertexts) for each unit of the chosen encoding
+    if encoding == "packed":
+        # Pack as many rows as fit into the slots of one ciphertext; each row
+        # is padded to a power-of-two stride so the server can sum it with rotations
+        stride = 1 << (X_poly.shape[1] - 1).bit_length()
+        rows_per_ct = (poly_modulus_degree // 2) // stride
+        for start in range(0, len(X_poly), rows_per_ct):
+            chunk = X_poly[start:start + rows_per_ct]
+            yield len(chunk), [ts.enc_matmul_encoding(context, chunk).serialize()]
+    elif encoding == "column":
+        # Encrypt the batch feature-wise: every group of up to N/2 patients becomes
+        # one ciphertext per polynomial feature, holding that feature for each patient
+        slots = poly_modulus_degree // 2
+        for start in range(0, len(X_poly), slots):
+            chunk = X_poly[start:start + slots]
+            yield len(chunk), [ts.ckks_vector(context, col).serialize() for col in chunk.T]
+    else:
+        # Encrypt each row
+        for row in X_poly:
+            yield 1, [ts.ckks_vector(context, row).serialize()]
+
+
+def activation_fields(sigmoid=False, sigmoid_degree=None):
+    # Header fields asking the server for encrypted probabilities; without a
+    # degree the server uses its own default
+    if not sigmoid:
+        return {}
+    fields = {"activation": "sigmoid"}
+    if sigmoid_degree is not None:
+        fields["sigmoid_degree"] = sigmoid_degree
+    return fields
+
+
+def model_fields(models=None, ensemble=None):
+    # Header fields asking the server to score several model versions in one
+    # pass (plus their averaged score), instead of just the params' model
+    if not models:
+        return {}
+    fields = {"models": list(models)}
+    if ensemble is not None:
+        fields["ensemble"] = ensemble
+    return fields
+
+
+def open_container(f, encoding, public_context, n_features, compression="none", profile=None, activation=None):
+    # The profile's parameters go into the header so the server can check
+    # they leave enough depth for its model
+    return ContainerWriter(
+        f,
+        encoding=encoding,
+        context_hash=hashlib.sha256(public_context).hexdigest(),
+        compression=compression,
+        parts_per_unit=n_features if encoding == "column" else 1,
+        **(header_fields(profile) if profile is not None else {}),
+        **(activation or {})
+    )
+
+
+def write_container(f, units, encoding, public_context, n_features, compression="none", profile=None,
+                    activation=None):
+    # Write units straight into the ciphertext container
+    writer = open_container(f, encoding, public_context, n_features, compression, profile, activation)
+    for rows, parts in units:
+        writer.add_unit(rows, parts)
+    writer.close()
+    return writer
+
+
+def unit_rows(encoding, n_features, poly_modulus_degree=POLY_MODULUS_DEGREE):
+    # Patient rows that make up one full unit of the encoding
+    if encoding == "packed":
+        return (poly_modulus_degree // 2) // (1 << (n_features - 1).bit_length())
+    if encoding == "column":
+        return poly_modulus_degree // 2
+    return 1
+
+
+def iter_feature_chunks(input_path, param, chunk_rows, expand=True):
+    # Normalize and expand the CSV chunk by chunk so memory stays flat
+    for df in pd.read_csv(input_path, chunksize=chunk_rows):
+        yield prepare_features(df, param, expand)
+
+
+# --- Pool worker state ---
+_worker_context = None
+
+
+def _init_worker(context_bytes):
+    global _worker_context
+    _worker_context = ts.context_from(context_bytes)
+
+
+def _encrypt_chunk(X_chunk, encoding, poly_modulus_degree):
+    return list(encrypt_units(_worker_context, X_chunk, encoding, poly_modulus_degree))
+
+
+def encrypt_csv(f, context, public_context, param, encoding, input_path=INPUT_PATH, compression="none",
+                workers=1, chunk_rows=CHUNK_ROWS, profile=_DEFAULT, activation=None, features="expanded",
+                timer=NULL_TIMER, outputs=None):
+    # Encrypt a CSV into a container as a pipeline: vectorized feature
+    # preparation per chunk, encryption on a worker pool, and units written
+    # in input order as soon as their chunk is done. Stage times go to `timer`
+    # (with a pool, "encrypt" is the time spent waiting on the workers)
+    poly_modulus_degree = profile["poly_modulus_degree"]
+    # With raw features only the normalized inputs are encrypted and the
+    # server computes the polynomial terms
+    expand = features == "expanded"
+    n_features = param["poly"].n_output_features_ if expand else len(param["mean"])
+    # Chunks must hold whole units so packed/column units are never split
+    per_unit = unit_rows(encoding, n_features, poly_modulus_degree)
+    chunk_rows = max(chunk_rows // per_unit, 1) * per_unit
+    chunks = timed(iter_feature_chunks(input_path, param, chunk_rows, expand), timer, "prepare")
+    extra = {**(activation or {}), **(outputs or {})}
+    if not expand:
+        extra["features"] = "raw"
+    if "version" in param:
+        # Pin the server to the model version these params came from
+        extra["model_version"] = param["version"]
+    writer = open_container(f, encoding, public_context, n_features, compression, profile, extra)
+
+    def write_units(units):
+        for rows, parts in units:
+            with timer.stage("write"):
+                writer.add_unit(rows, parts)
+
+    if workers <= 1:
+        for X_chunk in chunks:
+            write_units(timed(encrypt_units(context, X_chunk, encoding, poly_modulus_degree), timer, "encrypt"))
+        with timer.stage("write"):
+            writer.close()
+        return writer
+
+    # Workers only need the public key to encrypt, not the Galois keys
+    worker_context = context.serialize(save_galois_keys=False, save_relin_keys=False)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(worker_context,)
+    ) as pool:
+        pending = deque()
+        for X_chunk in chunks:
+            pending.append(pool.submit(_encrypt_chunk, X_chunk, encoding, poly_modulus_degree))
+            # Keep a bounded number of chunks in flight
+            while len(pending) >= 2 * workers:
+                with timer.stage("encrypt"):
+                    units = pending.popleft().result()
+                write_units(units)
+        while pending:
+            with timer.stage("encrypt"):
+                units = pending.popleft().result()
+            write_units(units)
+    with timer.stage("write"):
+        writer.close()
+    return writer
+
+
+def encrypt_file(input_path=INPUT_PATH, output_path=OUTPUT_PATH, encoding="row", profile_name=DEFAULT_PROFILE,
+                 features="expanded", activation=None, outputs=None, compression="none", workers=1,
+                 chunk_rows=CHUNK_ROWS, params_path=PARAMS_PATH, contexts=None, new_keys=False, timer=NULL_TIMER):
+    # Encrypt one CSV into a container at output_path, written under a
+    # temporary name so an interrupted run never leaves a partial file.
+    # `contexts` is a (context, public context) pair already loaded by the
+    # caller; by default the stored keys for the profile are used
+    with timer.stage("params"):
+        param = load_params(params_path)
+    profile = get_profile(profile_name)
+    if contexts is None:
+        with timer.stage("context"):
+            contexts = load_context(encoding, profile, regenerate=new_keys)
+    context, public_context = contexts
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        writer = encrypt_csv(f, context, public_context, param, encoding, input_path=input_path,
+                             compression=compression, workers=workers, chunk_rows=chunk_rows, profile=profile,
+                             activation=activation, features=features, timer=timer, outputs=outputs)
+    os.replace(tmp_path, output_path)
+    return writer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encrypt ./data/user_data.csv for encrypted inference")
+    parser.add_argument("--encoding", choices=["row", "packed", "column"], default="row",
+                        help="row: one ciphertext per patient; packed: many patients per ciphertext; "
+                             "column: one ciphertext per feature across many patients")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="CKKS parameters, by multiplicative depth: " +
+                             ", ".join(f"{name} ({get_profile(name)['depth']})" for name in PROFILES) +
+                             "; linear scoring needs 1, raw features 2, the default sigmoid 3 more")
+    parser.add_argument("--features", choices=["expanded", "raw"], default="expanded",
+                        help="raw: encrypt only the normalized inputs and let the server compute the "
+                             "polynomial terms (column encoding, needs the standard or deep profile)")
+    parser.add_argument("--sigmoid", action="store_true",
+                        help="ask the server for encrypted probabilities (needs the deep profile)")
+    parser.add_argument("--sigmoid-degree", type=int, default=None,
+                        help="degree of the server's sigmoid polynomial (default: the server's choice)")
+    parser.add_argument("--models", nargs="+", default=None, metavar="VERSION",
+                        help="score with each of these model versions in one pass; the params' model "
+                             "still defines the features, and the results get a column per model")
+    parser.add_argument("--ensemble", choices=["mean"], default=None,
+                        help="with --models, also return the models' averaged score")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none",
+                        help="compress ciphertext blobs in the container (zstd needs the zstandard package)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="encryption processes (1 encrypts in this process)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                        help="CSV rows prepared and encrypted per chunk")
+    parser.add_argument("--new-keys", action="store_true",
+                        help="discard the stored keys for this parameter set and generate new ones")
+    parser.add_argument("--timings", action="store_true", help="print a per-stage timing breakdown")
+    args = parser.parse_args()
+    if args.features == "raw" and args.encoding != "column":
+        parser.error("--features raw needs --encoding column")
+    if args.ensemble and not args.models:
+        parser.error("--ensemble needs --models")
+
+    started = time.perf_counter()
+    timer = StageTimer() if args.timings else NULL_TIMER
+    os.makedirs("./params", exist_ok=True)
+    writer = encrypt_file(INPUT_PATH, OUTPUT_PATH, args.encoding, args.profile, args.features,
+                          activation=activation_fields(args.sigmoid, args.sigmoid_degree),
+                          outputs=model_fields(args.models, args.ensemble), compression=args.compression,
+                          workers=args.workers, chunk_rows=args.chunk_rows, new_keys=args.new_keys, timer=timer)
+
+    print(f"Encrypted and saved {writer.row_count} rows ({args.encoding}, {args.profile}) to {OUTPUT_PATH}")
+    if args.timings:
+        print(timer.report(time.perf_counter() - started))
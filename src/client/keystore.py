@@ -0,0 +1,106 @@
+import tenseal as ts
+import hashlib
+import os
+import shutil
+
+# --- Client key store ---
+# One directory per CKKS parameter set under ./params/keys, holding the
+# secret context (for encryption and decryption), the public context sent to
+# the server and its fingerprint (the SHA-256 the server and the ciphertext
+# containers identify it by). Keys are generated on first use and loaded
+# afterwards, so the fingerprint stays stable across runs.
+KEYS_DIR = "./params/keys"
+
+PUBLIC_NAME      = "context_public.ckks"
+SECRET_NAME      = "context_private.ckks"
+FINGERPRINT_NAME = "fingerprint"
+
+
+def fingerprint(public_context):
+    return hashlib.sha256(public_context).hexdigest()
+
+
+def needs_galois_keys(encoding):
+    # Row dot products and packed matmuls sum with rotations; the column
+    # kernel only multiplies by plaintext scalars and adds
+    return encoding != "column"
+
+
+def key_id(poly_modulus_degree, coeff_mod_bit_sizes, global_scale, galois_keys):
+    # e.g. "n8192-60_40_40_60-s40-galois"
+    bits = "_".join(str(b) for b in coeff_mod_bit_sizes)
+    scale_bits = int(global_scale).bit_length() - 1
+    return f"n{poly_modulus_degree}-{bits}-s{scale_bits}-{'galois' if galois_keys else 'nogalois'}"
+
+
+class KeyStore:
+    """Persistent CKKS contexts, one per parameter set and Galois key choice."""
+
+    def __init__(self, root=KEYS_DIR):
+        self.root = root
+
+    def load_or_create(self, name, create, regenerate=False):
+        # Return (secret context, public context bytes, fingerprint) of key set
+        # `name`, calling create() to build the context the first time (or
+        # again when regenerate=True)
+        key_dir = os.path.join(self.root, name)
+        if regenerate:
+            shutil.rmtree(key_dir, ignore_errors=True)
+        if os.path.exists(os.path.join(key_dir, FINGERPRINT_NAME)):
+            return self._load(key_dir)
+
+        context = create()
+        public_context = context.serialize()
+        fp = fingerprint(public_context)
+
+        # Write into a scratch directory and rename it, so a crash never leaves
+        # a half-written key set behind
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = key_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, PUBLIC_NAME), "wb") as f:
+            f.write(public_context)
+        with open(os.path.join(tmp_dir, SECRET_NAME), "wb") as f:
+            f.write(context.serialize(save_secret_key=True))
+        with open(os.path.join(tmp_dir, FINGERPRINT_NAME), "w") as f:
+            f.write(fp)
+        os.replace(tmp_dir, key_dir)
+        return context, public_context, fp
+
+    def _load(self, key_dir):
+        with open(os.path.join(key_dir, SECRET_NAME), "rb") as f:
+            context = ts.context_from(f.read())
+        with open(os.path.join(key_dir, PUBLIC_NAME), "rb") as f:
+            public_context = f.read()
+        with open(os.path.join(key_dir, FINGERPRINT_NAME)) as f:
+            fp = f.read().strip()
+        return context, public_context, fp
+
+    def find(self, fp):
+        # Directory of the key set with this fingerprint, or None
+        if not os.path.isdir(self.root):
+            return None
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name, FINGERPRINT_NAME)
+            if os.path.exists(path):
+                with open(path) as f:
+                    if f.read().strip() == fp:
+                        return os.path.join(self.root, name)
+        return None
+
+    def secret_context_path(self, fp):
+        key_dir = self.find(fp)
+        return None if key_dir is None else os.path.join(key_dir, SECRET_NAME)
+
+    def activate(self, fp, public_path, secret_path):
+        # Copy a key set to the fixed paths decrypt.py and client.py read,
+        # skipping the write when they already hold it
+        if os.path.exists(public_path):
+            with open(public_path, "rb") as f:
+                if fingerprint(f.read()) == fp:
+                    return False
+        key_dir = self.find(fp)
+        shutil.copyfile(os.path.join(key_dir, SECRET_NAME), secret_path)
+        shutil.copyfile(os.path.join(key_dir, PUBLIC_NAME), public_path)
+        return True
@@ -11,9 +11,14 @@ def safe_remove(path):
 
 # Client-side cleanup
 safe_remove("./data/encrypted_user_data.pkl")
+safe_remove("./data/encrypted_user_data.ppmc")
 safe_remove("./data/predictions.csv")
+safe_remove("./data/predictions.parquet")
+safe_remove("./data/predictions.arrow")
 safe_remove("./params")
 safe_remove("./encrypted_predictions.pkl")
+safe_remove("./encrypted_predictions.ppmc")
+safe_remove("./encrypted_predictions.ppmc.parts")
 
 # Server-side cleanup
 safe_remove("../server/output")
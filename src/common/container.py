@@ -0,0 +1,254 @@
+import os
+import json
+import mmap
+import struct
+import zlib
+from bisect import bisect_right
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Binary ciphertext container ---
+# Layout (all integers big-endian):
+#   MAGIC, VERSION
+#   [header length: uint32][header JSON]
+#   [ciphertext blobs, contiguous]
+#   [index: per unit `rows: uint32`, then per blob `offset: uint64, length: uint64, crc32: uint32`]
+#   [trailer: index offset: uint64, units: uint64, rows: uint64, MAGIC]
+# The header records the scheme, the public context hash, the encoding, the
+# blob compression and how many blobs make up one unit (44 for column groups).
+# The index sits at the end so writers can stream units without knowing the
+# count up front, and readers can mmap the file and seek to any unit.
+MAGIC   = b"PPMC"
+VERSION = 1
+
+COMPRESSIONS = ("none", "zstd")
+
+_PREAMBLE = struct.Struct(">4sBI")
+_ROWS     = struct.Struct(">I")
+_BLOB     = struct.Struct(">QQI")
+_TRAILER  = struct.Struct(">QQQ4s")
+
+
+class ContainerError(ValueError):
+    pass
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ContainerError("zstd compression requires the `zstandard` package (pip install zstandard)")
+
+
+def compress_blob(data, compression):
+    if compression == "zstd":
+        _require_zstd()
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def decompress_blob(data, compression):
+    if compression == "zstd":
+        _require_zstd()
+        return zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data)
+
+
+def is_container(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def parse_row_range(value):
+    # "start:stop" with either end optional, e.g. "100:200" or ":500"
+    start, _, stop = value.partition(":")
+    return int(start or 0), int(stop) if stop else None
+
+
+def units_batch(header, units):
+    # Build a batch dict (the shape InferenceEngine scores) from (rows, parts) units
+    encoding = header["encoding"]
+    rows, ciphertexts = [], []
+    for n, parts in units:
+        rows.append(n)
+        ciphertexts.append(parts if encoding == "column" else parts[0])
+    batch = {"encoding": encoding, "rows": rows, "ciphertexts": ciphertexts}
+    # The feature layout, output activation and models requested in the
+    # header travel with every chunk
+    for key in ("features", "activation", "sigmoid_degree", "output_weights"):
+        if header.get(key) is not None:
+            batch[key] = header[key]
+    return batch
+
+
+def chunk_units(header, units, chunk_size):
+    # Group (rows, parts) units into batch dicts of at most `chunk_size`
+    # units, decompressing the parts if the header says they are compressed
+    compression = header.get("compression", "none")
+    chunk = []
+    for rows, parts in units:
+        chunk.append((rows, [decompress_blob(part, compression) for part in parts]))
+        if len(chunk) >= chunk_size:
+            yield units_batch(header, chunk)
+            chunk = []
+    if chunk:
+        yield units_batch(header, chunk)
+
+
+class ContainerWriter:
+    """Append units to a container file; the index is written on close()."""
+
+    def __init__(self, f, encoding, context_hash=None, compression="none", parts_per_unit=1,
+                 scheme="CKKS", **extra):
+        if compression not in COMPRESSIONS:
+            raise ContainerError(f"Unsupported compression: {compression!r}")
+        if compression == "zstd":
+            _require_zstd()
+        self.header = {
+            "scheme": scheme,
+            "context_hash": context_hash,
+            "encoding": encoding,
+            "compression": compression,
+            "parts_per_unit": parts_per_unit,
+            **extra
+        }
+        self._f = f
+        self._rows = []
+        self._blobs = []
+        header_bytes = json.dumps(self.header).encode("utf-8")
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        self._offset = _PREAMBLE.size + len(header_bytes)
+
+    @property
+    def row_count(self):
+        return sum(self._rows)
+
+    def add_unit(self, rows, parts, compressed=False):
+        # `parts` are serialized ciphertexts; pass compressed=True when they
+        # already use this container's compression (e.g. relayed from a stream)
+        if len(parts) != self.header["parts_per_unit"]:
+            raise ContainerError(f"Expected {self.header['parts_per_unit']} parts per unit, got {len(parts)}")
+        for part in parts:
+            blob = part if compressed else compress_blob(part, self.header["compression"])
+            self._f.write(blob)
+            self._blobs.append((self._offset, len(blob), zlib.crc32(blob)))
+            self._offset += len(blob)
+        self._rows.append(rows)
+
+    def close(self):
+        index_offset = self._offset
+        for rows in self._rows:
+            self._f.write(_ROWS.pack(rows))
+        for blob in self._blobs:
+            self._f.write(_BLOB.pack(*blob))
+        self._f.write(_TRAILER.pack(index_offset, len(self._rows), self.row_count, MAGIC))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class ContainerReader:
+    """Random access to a container through mmap (or any bytes-like buffer)."""
+
+    def __init__(self, source, verify=True):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._file = None
+            self._buf = memoryview(source)
+        else:
+            self._file = open(source, "rb")
+            # mmap can't map an empty file; report it like any other truncation
+            if os.fstat(self._file.fileno()).st_size < _PREAMBLE.size + _TRAILER.size:
+                self._file.close()
+                raise ContainerError("Truncated ciphertext container")
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Check each blob's CRC32 as it is read, so corrupted uploads fail
+        # as a ContainerError instead of reaching TenSEAL
+        self.verify = verify
+
+        buf = self._buf
+        if len(buf) < _PREAMBLE.size + _TRAILER.size:
+            raise ContainerError("Truncated ciphertext container")
+        magic, version, header_len = _PREAMBLE.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ContainerError("Not a PPML ciphertext container")
+        if version != VERSION:
+            raise ContainerError(f"Unsupported container version {version}")
+        self.header = json.loads(bytes(buf[_PREAMBLE.size:_PREAMBLE.size + header_len]).decode("utf-8"))
+
+        index_offset, self.unit_count, self.row_count, end_magic = _TRAILER.unpack_from(buf, len(buf) - _TRAILER.size)
+        if end_magic != MAGIC:
+            raise ContainerError("Truncated ciphertext container")
+        self._rows_offset = index_offset
+        self._blobs_offset = index_offset + self.unit_count * _ROWS.size
+
+        # Cumulative row offsets, so row ranges map to units without a scan
+        self._row_starts = [0]
+        for i in range(self.unit_count):
+            (rows,) = _ROWS.unpack_from(buf, self._rows_offset + i * _ROWS.size)
+            self._row_starts.append(self._row_starts[-1] + rows)
+
+    @property
+    def encoding(self):
+        return self.header["encoding"]
+
+    @property
+    def compression(self):
+        return self.header.get("compression", "none")
+
+    def unit_rows(self, i):
+        return self._row_starts[i + 1] - self._row_starts[i]
+
+    def unit(self, i, raw=False):
+        # Return (rows, parts) of unit `i`; raw=True skips decompression
+        if not 0 <= i < self.unit_count:
+            raise IndexError(i)
+        per_unit = self.header["parts_per_unit"]
+        parts = []
+        for j in range(i * per_unit, (i + 1) * per_unit):
+            offset, length, crc = _BLOB.unpack_from(self._buf, self._blobs_offset + j * _BLOB.size)
+            blob = self._buf[offset:offset + length]
+            if self.verify and zlib.crc32(blob) != crc:
+                raise ContainerError(f"Checksum mismatch in unit {i}")
+            parts.append(bytes(blob) if raw else decompress_blob(blob, self.compression))
+        return self.unit_rows(i), parts
+
+    def check(self):
+        # Verify every blob's checksum up front, e.g. before queueing a job
+        per_unit = self.header["parts_per_unit"]
+        for i in range(self.unit_count):
+            for j in range(i * per_unit, (i + 1) * per_unit):
+                offset, length, crc = _BLOB.unpack_from(self._buf, self._blobs_offset + j * _BLOB.size)
+                if zlib.crc32(self._buf[offset:offset + length]) != crc:
+                    raise ContainerError(f"Checksum mismatch in unit {i}")
+
+    def units_for_rows(self, start, stop):
+        # Unit range covering patient rows [start, stop), plus the row offset
+        # of the first unit so callers can trim packed/column results
+        stop = min(stop, self.row_count)
+        if start >= stop:
+            return range(0, 0), start
+        first = bisect_right(self._row_starts, start) - 1
+        last = bisect_right(self._row_starts, stop - 1) - 1
+        return range(first, last + 1), self._row_starts[first]
+
+    def iter_units(self, units=None, raw=False):
+        for i in (range(self.unit_count) if units is None else units):
+            yield self.unit(i, raw=raw)
+
+    def close(self):
+        if self._file is not None:
+            self._buf.close()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,162 @@
+import json
+import struct
+
+from common.container import compress_blob, chunk_units
+
+# --- Framed ciphertext stream ---
+# A stream starts with MAGIC and is followed by length-prefixed frames:
+#   [kind: uint8][length: uint32][payload]
+# Upload:   CONTEXT, HEADER, UNIT..., END
+# Response: HEADER, UNIT..., END
+# A UNIT is one scoring unit of the batch encoding (a row ciphertext, a packed
+# ciphertext or a column group) and carries how many patient rows it covers.
+MAGIC = b"PPMF\x01"
+MEDIA_TYPE = "application/x-ppml-frames"
+
+KIND_END     = 0
+KIND_HEADER  = 1
+KIND_CONTEXT = 2
+KIND_UNIT    = 3
+
+_FRAME = struct.Struct(">BI")
+_UNIT  = struct.Struct(">II")
+_PART  = struct.Struct(">I")
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(kind, payload=b""):
+    return _FRAME.pack(kind, len(payload)) + payload
+
+
+def encode_header(header):
+    return encode_frame(KIND_HEADER, json.dumps(header).encode("utf-8"))
+
+
+def encode_context(context_bytes):
+    return encode_frame(KIND_CONTEXT, context_bytes)
+
+
+def encode_unit(rows, parts):
+    payload = [_UNIT.pack(rows, len(parts))]
+    for part in parts:
+        payload.append(_PART.pack(len(part)))
+        payload.append(part)
+    return encode_frame(KIND_UNIT, b"".join(payload))
+
+
+def encode_end():
+    return encode_frame(KIND_END)
+
+
+def decode_unit(payload):
+    rows, n_parts = _UNIT.unpack_from(payload, 0)
+    offset = _UNIT.size
+    parts = []
+    for _ in range(n_parts):
+        (length,) = _PART.unpack_from(payload, offset)
+        offset += _PART.size
+        parts.append(bytes(payload[offset:offset + length]))
+        offset += length
+    if offset != len(payload):
+        raise FrameError("Malformed unit frame")
+    return rows, parts
+
+
+def decode_header(payload):
+    return json.loads(bytes(payload).decode("utf-8"))
+
+
+def batch_units(batch):
+    # Convert an in-memory batch (legacy list or encoding dict) into
+    # (header, iterator of (rows, parts)) for framing
+    if isinstance(batch, list):
+        batch = {"encoding": "row", "ciphertexts": batch}
+    encoding = batch["encoding"]
+    ciphertexts = batch["ciphertexts"]
+    parts_per_unit = len(ciphertexts[0]) if encoding == "column" and ciphertexts else 1
+    header = {"encoding": encoding, "parts_per_unit": parts_per_unit}
+    rows = batch.get("rows") or [1] * len(ciphertexts)
+    if encoding == "column":
+        units = ((n, list(group)) for group, n in zip(ciphertexts, rows))
+    else:
+        units = ((n, [ct]) for ct, n in zip(ciphertexts, rows))
+    return header, units
+
+
+def iter_frame_units(frames):
+    # Decode the UNIT frames that follow the header
+    for kind, payload in frames:
+        if kind != KIND_UNIT:
+            raise FrameError(f"Unexpected frame kind {kind} among units")
+        yield decode_unit(payload)
+
+
+def iter_batches(header, frames, chunk_size):
+    return chunk_units(header, iter_frame_units(frames), chunk_size)
+
+
+def compress_parts(parts, header):
+    return [compress_blob(part, header.get("compression", "none")) for part in parts]
+
+
+def iter_stream(header, units, context_bytes=None):
+    # Yield the encoded stream piece by piece, suitable for a chunked HTTP body
+    yield MAGIC
+    if context_bytes is not None:
+        yield encode_context(context_bytes)
+    yield encode_header(header)
+    for rows, parts in units:
+        yield encode_unit(rows, parts)
+    yield encode_end()
+
+
+def read_frames(f):
+    # Read (kind, payload) frames from a binary file object up to END
+    if f.read(len(MAGIC)) != MAGIC:
+        raise FrameError("Not a PPML frame stream")
+    while True:
+        head = f.read(_FRAME.size)
+        if len(head) < _FRAME.size:
+            raise FrameError("Truncated frame stream")
+        kind, length = _FRAME.unpack(head)
+        payload = f.read(length)
+        if len(payload) < length:
+            raise FrameError("Truncated frame stream")
+        if kind == KIND_END:
+            return
+        yield kind, payload
+
+
+class FrameDecoder:
+    """Incremental decoder for streams that arrive in arbitrary chunks."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._started = False
+        self.finished = False
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        if not self._started:
+            if len(self._buffer) < len(MAGIC):
+                return frames
+            if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+                raise FrameError("Not a PPML frame stream")
+            del self._buffer[:len(MAGIC)]
+            self._started = True
+        while not self.finished and len(self._buffer) >= _FRAME.size:
+            kind, length = _FRAME.unpack_from(self._buffer, 0)
+            end = _FRAME.size + length
+            if len(self._buffer) < end:
+                break
+            payload = bytes(self._buffer[_FRAME.size:end])
+            del self._buffer[:end]
+            if kind == KIND_END:
+                self.finished = True
+                break
+            frames.append((kind, payload))
+        return frames
@@ -0,0 +1,58 @@
+# --- CKKS parameter profiles ---
+# Named parameter sets shared by the client (which encrypts under one) and
+# the server (which checks it leaves enough depth for the model). Depth is
+# the number of rescales a fresh ciphertext can take: one per inner prime.
+#   fast:     smallest ring, ~3e-4 score error, enough for linear scoring
+#   balanced: 8192 ring with a single inner prime, ~1e-6 score error
+#   standard: 8192 ring with two inner primes, room for one ciphertext
+#             multiplication (server-side feature expansion)
+#   deep:     16384 ring with four inner primes for polynomial activations
+PROFILES = {
+    "fast": {
+        "poly_modulus_degree": 4096,
+        "coeff_mod_bit_sizes": [36, 32, 36],
+        "scale_bits": 32
+    },
+    "balanced": {
+        "poly_modulus_degree": 8192,
+        "coeff_mod_bit_sizes": [60, 40, 60],
+        "scale_bits": 40
+    },
+    "standard": {
+        "poly_modulus_degree": 8192,
+        "coeff_mod_bit_sizes": [60, 40, 40, 60],
+        "scale_bits": 40
+    },
+    "deep": {
+        "poly_modulus_degree": 16384,
+        "coeff_mod_bit_sizes": [60, 40, 40, 40, 40, 60],
+        "scale_bits": 40
+    }
+}
+DEFAULT_PROFILE = "balanced"
+
+
+def depth(coeff_mod_bit_sizes):
+    return len(coeff_mod_bit_sizes) - 2
+
+
+def get_profile(name):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown CKKS profile {name!r}, expected one of {', '.join(PROFILES)}")
+    profile = PROFILES[name]
+    return {
+        "name": name,
+        **profile,
+        "global_scale": 2 ** profile["scale_bits"],
+        "depth": depth(profile["coeff_mod_bit_sizes"])
+    }
+
+
+def header_fields(profile):
+    # What a ciphertext container records about the profile it was made under
+    return {
+        "profile": profile["name"],
+        "poly_modulus_degree": profile["poly_modulus_degree"],
+        "coeff_mod_bit_sizes": profile["coeff_mod_bit_sizes"],
+        "depth": profile["depth"]
+    }
@@ -1,41 +1,626 @@
 import tenseal as ts
+import numpy as np
 import pickle
 import os
+import sys
+import argparse
+import tempfile
+import threading
+import weakref
+import multiprocessing
+from functools import lru_cache
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 
-# Ensure the context file exists
-context_path = "./output/context_public.ckks"
-if not os.path.exists(context_path):
-    raise FileNotFoundError("CKKS encryption context file not found. Expected at ./model/params/context_public.ckks")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.container import ContainerReader, ContainerWriter, ContainerError, chunk_units, parse_row_range
+from common.metrics import StageTimer, NULL_TIMER, timed
+from protocol import context_hash, output_parts
 
-# Load encryption context from client-provided file
-with open(context_path, "rb") as f:
-    context = ts.context_from(f.read())
+# --- Path Configuration ---
+BASE_DIR      = os.path.dirname(__file__)
+PARAMS_PATH   = os.path.join(BASE_DIR, "output/params.pkl")
+CONTEXT_PATH  = os.path.join(BASE_DIR, "output/context_public.ckks")
+ENCRYPTED_IN  = os.path.join(BASE_DIR, "output/encrypted_user_data.ppmc")
+ENCRYPTED_OUT = os.path.join(BASE_DIR, "output/encrypted_predictions.ppmc")
+# Rescales the linear kernels spend: one plaintext multiplication
+MODEL_DEPTH = 1
+# Raw (unexpanded) feature columns also spend one ciphertext multiplication
+QUADRATIC_DEPTH = 2
+FEATURE_LAYOUTS = ("expanded", "raw")
+# Deepest modulus chain probe_depth() looks for
+MAX_PROBE_DEPTH = 8
 
-# Load full model bundle (weights, intercept)
-with open("./output/params.pkl", "rb") as f:
-    model_bundle = pickle.load(f)
+# Multi-model requests: other model versions scored in the same pass, plus
+# an optional ensemble output
+MAX_OUTPUTS = 8
+ENSEMBLES   = ("mean",)
 
-weights = model_bundle["weights"]
-intercept = model_bundle["intercept"]
+# Encrypted sigmoid: a least-squares polynomial over [-SIGMOID_BOUND, SIGMOID_BOUND]
+ACTIVATIONS        = ("sigmoid",)
+SIGMOID_DEGREE     = 5
+SIGMOID_BOUND      = 10.0
+MAX_SIGMOID_DEGREE = 15
 
-# Encrypt model weights
-enc_weights = ts.ckks_vector(context, weights)
-enc_intercept = ts.ckks_vector(context, [intercept])
 
-# Load all encrypted user data from batch file
-with open("./output/encrypted_user_data.pkl", "rb") as f:
-    encrypted_rows = pickle.load(f)
+def load_bundle(params_path=PARAMS_PATH):
+    with open(params_path, "rb") as f:
+        return pickle.load(f)
 
-vectors = [ts.ckks_vector_from(context, row) for row in encrypted_rows]
 
-# Perform inference
-all_preds = []
-for enc_x in vectors:
-    pred = enc_x.dot(enc_weights) + enc_intercept
-    all_preds.append(pred.serialize())
+def load_model(params_path=PARAMS_PATH):
+    # Load full model bundle (weights, intercept)
+    model_bundle = load_bundle(params_path)
+    return list(model_bundle["weights"]), float(model_bundle["intercept"])
 
-# Save all encrypted predictions to one pkl
-with open("./output/encrypted_predictions.pkl", "wb") as f:
-    pickle.dump(all_preds, f)
 
-print(f"Saved {len(all_preds)} encrypted predictions to ./data/encrypted_predictions.pkl")
+def quadratic_form(poly, weights):
+    # Split the weights of a degree-2 PolynomialFeatures model into the raw
+    # features' linear terms and an upper-triangular matrix of quadratic
+    # terms, so score = b + sum_i x_i * (linear[i] + sum_{j>=i} quadratic[i][j] * x_j)
+    if poly is None or poly.degree > 2 or getattr(poly, "interaction_only", False):
+        return None
+    n_raw = poly.powers_.shape[1]
+    linear = [0.0] * n_raw
+    quadratic = [[0.0] * n_raw for _ in range(n_raw)]
+    for powers, weight in zip(poly.powers_, weights):
+        terms = [i for i, power in enumerate(powers) for _ in range(power)]
+        if len(terms) == 1:
+            linear[terms[0]] += float(weight)
+        elif len(terms) == 2:
+            quadratic[terms[0]][terms[1]] += float(weight)
+    return linear, quadratic
+
+
+def rebase_model(model_bundle, target_bundle, seed=0):
+    # Re-express another model's score in the target bundle's feature space
+    # (its normalization and polynomial expansion), so both can be scored on
+    # ciphertexts prepared for the target. Degree-2 models trained with other
+    # normalization stats map exactly: an affine change of the raw features
+    # keeps the score a degree-2 polynomial. Solved by least squares on
+    # sampled inputs; a non-zero residual means it isn't representable
+    mean, std = np.asarray(target_bundle["mean"]), np.asarray(target_bundle["std"])
+    if len(model_bundle["mean"]) != len(mean):
+        raise ValueError(f"Model has {len(model_bundle['mean'])} raw features, expected {len(mean)}")
+    target_poly = target_bundle["poly"]
+    n_samples = 4 * (target_poly.n_output_features_ + 1)
+    X = np.random.default_rng(seed).standard_normal((n_samples, len(mean))) * std + mean
+    scores = (model_bundle["poly"].transform((X - model_bundle["mean"]) / model_bundle["std"])
+              @ np.asarray(model_bundle["weights"]) + model_bundle["intercept"])
+    design = np.hstack([target_poly.transform((X - mean) / std), np.ones((n_samples, 1))])
+    solution = np.linalg.lstsq(design, scores, rcond=None)[0]
+    if np.max(np.abs(design @ solution - scores)) > 1e-6 * max(1.0, np.max(np.abs(scores))):
+        raise ValueError("Model's feature transform can't be expressed in this model's features")
+    return [float(w) for w in solution[:-1]], float(solution[-1])
+
+
+@lru_cache(maxsize=None)
+def sigmoid_coefficients(degree, bound=SIGMOID_BOUND):
+    # Ascending power coefficients, the order CKKSVector.polyval expects
+    x = np.linspace(-bound, bound, 4001)
+    return tuple(np.polynomial.polynomial.polyfit(x, 1 / (1 + np.exp(-x)), degree))
+
+
+def activation_depth(sigmoid_degree):
+    # polyval evaluates a degree-d polynomial in floor(log2(d)) + 1 rescales
+    return sigmoid_degree.bit_length() if sigmoid_degree else 0
+
+
+def probe_depth(context, limit):
+    # TenSEAL doesn't expose the modulus chain, so count how many plaintext
+    # multiplications a fresh ciphertext survives, up to `limit`
+    enc = ts.ckks_vector(context, [1.0])
+    for level in range(limit):
+        try:
+            enc = enc * 1.0
+        except ValueError:
+            return level
+    return limit
+
+
+def spill_context(context_bytes, work_dir):
+    # Hand the public context to pool workers through a file in the
+    # request's own directory, so concurrent requests never share paths
+    path = os.path.join(work_dir, "context_public.ckks")
+    with open(path, "wb") as f:
+        f.write(context_bytes)
+    return path
+
+
+def split_batch(batch, chunk_size):
+    # Shard a batch into sub-batches of the same encoding, `chunk_size`
+    # ciphertexts (or column groups) each
+    if isinstance(batch, list):
+        for start in range(0, len(batch), chunk_size):
+            yield batch[start:start + chunk_size]
+        return
+    for start in range(0, len(batch["ciphertexts"]), chunk_size):
+        chunk = {**batch, "ciphertexts": batch["ciphertexts"][start:start + chunk_size]}
+        if "rows" in batch:
+            chunk["rows"] = batch["rows"][start:start + chunk_size]
+        yield chunk
+
+
+def merge_predictions(batch, chunks):
+    all_preds = [pred for _, preds in chunks for pred in preds]
+    if isinstance(batch, list):
+        return all_preds
+    return {**batch, "ciphertexts": all_preds}
+
+
+# --- Pool worker state ---
+_worker_engine = None
+
+
+def _init_worker(params_path, cache_size, sigmoid_degree, sigmoid_bound):
+    global _worker_engine
+    _worker_engine = InferenceEngine(params_path, cache_size=cache_size, sigmoid_degree=sigmoid_degree,
+                                     sigmoid_bound=sigmoid_bound)
+
+
+def _worker_ready():
+    # Answered once the worker's initializer has loaded its engine
+    return os.getpid()
+
+
+def _score_chunk(key, context_path, chunk):
+    # Returns the predictions and this chunk's stage timings, which the
+    # parent process folds into the request's timer
+    def load_bytes():
+        with open(context_path, "rb") as f:
+            return f.read()
+
+    timer = StageTimer()
+    context = _worker_engine.contexts.lookup(key, load_bytes, timer)
+    preds = _worker_engine.score(context, chunk, timer)
+    return (preds if isinstance(preds, list) else preds["ciphertexts"]), timer.totals()
+
+
+class ContextCache:
+    """LRU cache of parsed public contexts, keyed by the SHA-256 of their bytes."""
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, context_bytes, timer=NULL_TIMER):
+        return self.lookup(context_hash(context_bytes), lambda: context_bytes, timer)
+
+    def lookup(self, key, load_bytes, timer=NULL_TIMER):
+        with self._lock:
+            if key in self._contexts:
+                self._contexts.move_to_end(key)
+                timer.count("context_cache_hit")
+                return self._contexts[key]
+
+        # Deserialize outside the lock, it is the expensive part
+        timer.count("context_cache_miss")
+        with timer.stage("context"):
+            return self.put(key, ts.context_from(load_bytes()))
+
+    def put(self, key, context):
+        with self._lock:
+            self._contexts[key] = context
+            self._contexts.move_to_end(key)
+            while len(self._contexts) > self.max_size:
+                self._contexts.popitem(last=False)
+        return context
+
+
+class InferenceEngine:
+    """Keeps the model weights and recently seen contexts resident between requests."""
+
+    def __init__(self, params_path=PARAMS_PATH, cache_size=8, workers=1, chunk_size=16,
+                 sigmoid_degree=SIGMOID_DEGREE, sigmoid_bound=SIGMOID_BOUND, model_source=None):
+        self.params_path = params_path
+        self.cache_size = cache_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # Used when a client asks for the sigmoid without picking a degree
+        self.sigmoid_degree = sigmoid_degree
+        # Scores outside [-bound, bound] drift from the sigmoid; it should
+        # cover the model's score range
+        self.sigmoid_bound = sigmoid_bound
+        self.model_bundle = load_bundle(params_path)
+        self.weights = list(self.model_bundle["weights"])
+        self.intercept = float(self.model_bundle["intercept"])
+        self.quadratic_form = quadratic_form(self.model_bundle.get("poly"), self.weights)
+        # model_source(version) -> bundle of another model a request may ask
+        # for next to this one; their weights are rebased once and cached
+        self.model_source = model_source
+        self._rebased = {}
+        # Registry version this engine serves, set by the model registry
+        self.version = None
+        self.depth = MODEL_DEPTH
+        self.contexts = ContextCache(cache_size)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Plaintext weight operands, dropped together with their context
+        self._plain_weights = weakref.WeakKeyDictionary()
+        self._plain_lock = threading.Lock()
+        # Probed depth of each context
+        self._context_depths = weakref.WeakKeyDictionary()
+
+    def plain_weights(self, context):
+        with self._plain_lock:
+            operands = self._plain_weights.get(context)
+            if operands is None:
+                operands = (ts.plain_tensor(self.weights), [self.intercept])
+                self._plain_weights[context] = operands
+        return operands
+
+    def resolve_header(self, header, sigmoid_degree=None):
+        # Return the header with its request settled and validated: the
+        # feature layout, and the output activation (none for raw scores, or
+        # the sigmoid with an explicit polynomial degree). `sigmoid_degree`
+        # lets a local caller ask for probabilities itself
+        header = self.resolve_outputs(dict(header))
+        if header.get("features", "expanded") not in FEATURE_LAYOUTS:
+            raise ContainerError(f"Unsupported feature layout: {header['features']!r}")
+        if header.get("features") == "raw":
+            if header.get("encoding") != "column":
+                raise ContainerError("Raw features are only supported with the column encoding")
+            if self.quadratic_form is None:
+                raise ContainerError("This model's feature transform can't be evaluated on raw features")
+            n_raw = len(self.quadratic_form[0])
+            if header.get("parts_per_unit") not in (None, n_raw):
+                raise ContainerError(f"Expected {n_raw} raw feature columns, got {header['parts_per_unit']}")
+        elif header.get("encoding") == "column" and header.get("parts_per_unit") not in (None, len(self.weights)):
+            raise ContainerError(f"Expected {len(self.weights)} feature columns, got {header['parts_per_unit']}")
+
+        if sigmoid_degree is not None:
+            header["activation"] = "sigmoid"
+            header["sigmoid_degree"] = sigmoid_degree
+        activation = header.get("activation")
+        if activation is None:
+            header.pop("sigmoid_degree", None)
+            return header
+        if activation not in ACTIVATIONS:
+            raise ContainerError(f"Unsupported activation: {activation!r}")
+        degree = header.get("sigmoid_degree") or self.sigmoid_degree
+        if not isinstance(degree, int) or not 1 <= degree <= MAX_SIGMOID_DEGREE:
+            raise ContainerError(f"Sigmoid degree must be an integer from 1 to {MAX_SIGMOID_DEGREE}")
+        header["sigmoid_degree"] = degree
+        return header
+
+    def rebased(self, version):
+        # (weights, intercept) of another model version in this model's features
+        if version == self.version:
+            return self.weights, self.intercept
+        with self._plain_lock:
+            model = self._rebased.get(version)
+        if model is None:
+            if self.model_source is None:
+                raise ContainerError("This server can't score other model versions")
+            try:
+                model_bundle = self.model_source(version)
+            except KeyError:
+                raise ContainerError(f"Unknown model version: {version!r}")
+            try:
+                model = rebase_model(model_bundle, self.model_bundle)
+            except (KeyError, ValueError) as e:
+                raise ContainerError(f"Model {version} can't be scored with these features: {e}")
+            with self._plain_lock:
+                self._rebased[version] = model
+        return model
+
+    def resolve_outputs(self, header):
+        # Settle a multi-model request: "models" lists the versions to score
+        # in one pass over the ciphertexts (in output order), "ensemble" adds
+        # their averaged score. Their weights go into "output_weights" for the
+        # kernels and never back to the client
+        header.pop("output_weights", None)
+        header.pop("outputs", None)
+        versions, ensemble = header.get("models"), header.get("ensemble")
+        if versions is None:
+            if ensemble is not None:
+                raise ContainerError("An ensemble needs a list of models")
+            return header
+        if (not isinstance(versions, list) or not versions or len(set(versions)) != len(versions)
+                or not all(isinstance(v, str) for v in versions)):
+            raise ContainerError("models must be a non-empty list of distinct model versions")
+        if ensemble is not None and ensemble not in ENSEMBLES:
+            raise ContainerError(f"Unsupported ensemble: {ensemble!r}")
+        if len(versions) + (ensemble is not None) > MAX_OUTPUTS:
+            raise ContainerError(f"At most {MAX_OUTPUTS} outputs per request")
+        models = [self.rebased(version) for version in versions]
+        outputs = list(versions)
+        if ensemble == "mean":
+            # Averaging linear models is one linear model; the sigmoid, if
+            # requested, applies to the averaged score
+            models.append((list(np.mean([w for w, _ in models], axis=0)),
+                           float(np.mean([b for _, b in models]))))
+            outputs.append(ensemble)
+        header["outputs"] = outputs
+        header["output_weights"] = [([float(x) for x in w], float(b)) for w, b in models]
+        return header
+
+    def required_depth(self, header=None):
+        header = header or {}
+        depth = QUADRATIC_DEPTH if header.get("features") == "raw" else self.depth
+        return depth + activation_depth(header.get("sigmoid_degree"))
+
+    def check_depth(self, context_bytes, header=None, timer=NULL_TIMER):
+        # Reject ciphertexts whose CKKS parameters can't fit the model's
+        # multiplications (and the sigmoid's, if requested) before any
+        # scoring work: first by the profile the header declares, then by
+        # probing the context itself
+        required = self.required_depth(header)
+        if header is not None and header.get("depth") is not None and header["depth"] < required:
+            raise ContainerError(
+                f"CKKS profile {header.get('profile', 'custom')!r} has depth {header['depth']}, "
+                f"the model needs {required}; encrypt with a deeper profile"
+            )
+        context = self.contexts.get(context_bytes, timer)
+        with self._plain_lock:
+            context_depth = self._context_depths.get(context)
+        if context_depth is None:
+            context_depth = probe_depth(context, MAX_PROBE_DEPTH)
+            with self._plain_lock:
+                self._context_depths[context] = context_depth
+        if context_depth < required:
+            raise ContainerError(
+                f"The context's modulus chain allows depth {context_depth}, the model needs {required}"
+            )
+
+    def activate(self, enc_score, sigmoid_degree):
+        # Turn encrypted scores into encrypted probabilities, slot-wise
+        if not sigmoid_degree:
+            return enc_score
+        return enc_score.polyval(list(sigmoid_coefficients(sigmoid_degree, self.sigmoid_bound)))
+
+    # Every kernel takes `models`, a list of (weights, intercept) to score
+    # each unit with after parsing it once; a unit's output is then a list
+    # with one prediction per model. Without it the engine's own model is
+    # used and each output is a single prediction
+
+    def _outputs(self, preds, models, timer):
+        with timer.stage("serialize"):
+            preds = [pred.serialize() for pred in preds]
+        return preds if models is not None else preds[0]
+
+    def score_rows(self, context, encrypted_rows, sigmoid_degree=None, timer=NULL_TIMER, models=None):
+        # The weights are the server's own plaintext, so score with
+        # ciphertext x plaintext dot products instead of encrypting them.
+        # Several models are separate dot products: TenSEAL's vector-matrix
+        # product would give one ciphertext but costs ~15 dots per row
+        if models is None:
+            operands = [self.plain_weights(context)]
+        else:
+            operands = [(ts.plain_tensor(weights), [intercept]) for weights, intercept in models]
+
+        # Perform inference
+        all_preds = []
+        for row in encrypted_rows:
+            with timer.stage("parse"):
+                enc_x = ts.ckks_vector_from(context, row)
+            with timer.stage("evaluate"):
+                preds = [self.activate(enc_x.dot(plain_weights) + plain_intercept, sigmoid_degree)
+                         for plain_weights, plain_intercept in operands]
+            all_preds.append(self._outputs(preds, models, timer))
+        return all_preds
+
+    def score_packed(self, context, ciphertexts, rows, sigmoid_degree=None, timer=NULL_TIMER, models=None):
+        # Each ciphertext holds `n` rows; enc_matmul_plain multiplies by the
+        # plaintext weights and rotates-and-sums every row into one slot
+        all_preds = []
+        for ct, n in zip(ciphertexts, rows):
+            with timer.stage("parse"):
+                enc_x = ts.ckks_vector_from(context, ct)
+            with timer.stage("evaluate"):
+                preds = [self.activate(enc_x.enc_matmul_plain(weights, n) + [intercept] * n, sigmoid_degree)
+                         for weights, intercept in models or [(self.weights, self.intercept)]]
+            all_preds.append(self._outputs(preds, models, timer))
+        return all_preds
+
+    def score_columns(self, context, ciphertexts, rows, sigmoid_degree=None, timer=NULL_TIMER, models=None):
+        # Each group is one ciphertext per feature; the prediction is a weighted
+        # sum with plaintext scalars, so no rotations are needed
+        all_preds = []
+        for group, n in zip(ciphertexts, rows):
+            # zip() below would quietly drop the extra features or weights
+            if len(group) != len(self.weights):
+                raise ContainerError(f"Expected {len(self.weights)} feature columns, got {len(group)}")
+            with timer.stage("parse"):
+                xs = [ts.ckks_vector_from(context, ct) for ct in group]
+            with timer.stage("evaluate"):
+                preds = []
+                for weights, intercept in models or [(self.weights, self.intercept)]:
+                    pred = xs[0] * weights[0]
+                    for x, w in zip(xs[1:], weights[1:]):
+                        pred += x * w
+                    preds.append(self.activate(pred + [intercept] * n, sigmoid_degree))
+            all_preds.append(self._outputs(preds, models, timer))
+        return all_preds
+
+    def score_columns_quadratic(self, context, ciphertexts, rows, sigmoid_degree=None, timer=NULL_TIMER,
+                                models=None):
+        # Each group is one ciphertext per raw feature; the quadratic expansion
+        # happens here with one ciphertext multiplication per feature, using
+        # score = b + sum_i x_i * (linear[i] + sum_{j>=i} quadratic[i][j] * x_j)
+        if models is None:
+            forms = [(self.quadratic_form, self.intercept)]
+        else:
+            poly = self.model_bundle.get("poly")
+            forms = [(quadratic_form(poly, weights), intercept) for weights, intercept in models]
+        n_raw = len(forms[0][0][0])
+        all_preds = []
+        for group, n in zip(ciphertexts, rows):
+            if len(group) != n_raw:
+                raise ContainerError(f"Expected {n_raw} raw feature columns, got {len(group)}")
+            with timer.stage("parse"):
+                xs = [ts.ckks_vector_from(context, ct) for ct in group]
+            with timer.stage("evaluate"):
+                preds = []
+                for (linear, quadratic), intercept in forms:
+                    pred = None
+                    for i, x_i in enumerate(xs):
+                        inner = x_i * quadratic[i][i]
+                        for j in range(i + 1, len(xs)):
+                            inner += xs[j] * quadratic[i][j]
+                        term = x_i * (inner + [linear[i]] * n)
+                        pred = term if pred is None else pred + term
+                    preds.append(self.activate(pred + [intercept] * n, sigmoid_degree))
+            all_preds.append(self._outputs(preds, models, timer))
+        return all_preds
+
+    def score(self, context, batch, timer=NULL_TIMER):
+        # Legacy uploads are a bare list of row ciphertexts
+        if isinstance(batch, list):
+            timer.count("rows", len(batch))
+            return self.score_rows(context, batch, timer=timer)
+
+        encoding = batch.get("encoding")
+        sigmoid_degree = None
+        if batch.get("activation") == "sigmoid":
+            sigmoid_degree = batch.get("sigmoid_degree") or self.sigmoid_degree
+        models = batch.get("output_weights")
+        if encoding == "row":
+            preds = self.score_rows(context, batch["ciphertexts"], sigmoid_degree, timer, models)
+        elif encoding == "packed":
+            preds = self.score_packed(context, batch["ciphertexts"], batch["rows"], sigmoid_degree, timer, models)
+        elif encoding == "column" and batch.get("features") == "raw":
+            preds = self.score_columns_quadratic(context, batch["ciphertexts"], batch["rows"], sigmoid_degree,
+                                                 timer, models)
+        elif encoding == "column":
+            preds = self.score_columns(context, batch["ciphertexts"], batch["rows"], sigmoid_degree, timer, models)
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding!r}")
+        timer.count("rows", sum(batch["rows"]) if "rows" in batch else len(preds))
+        return {**batch, "ciphertexts": preds}
+
+    def pool(self):
+        # Workers each load the weights once and keep their own context cache
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.params_path, self.cache_size, self.sigmoid_degree, self.sigmoid_bound)
+                )
+        return self._pool
+
+    def warm_up(self):
+        # Start the scoring workers ahead of the first request; each builds
+        # its own engine, and unpickling the bundle alone imports sklearn
+        if self.workers > 1:
+            pool = self.pool()
+            for future in [pool.submit(_worker_ready) for _ in range(self.workers)]:
+                future.result()
+        return self
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def iter_predict(self, batch, context_bytes, timer=NULL_TIMER):
+        return self.iter_predict_chunks(split_batch(batch, self.chunk_size), context_bytes, timer)
+
+    def iter_predict_chunks(self, chunks, context_bytes, timer=NULL_TIMER):
+        # Yield (chunk, encrypted predictions) pairs in input order. `chunks`
+        # may be a lazy iterator; only a bounded window of it is in flight.
+        # Stage times (from the workers too) are added to `timer`
+        if self.workers <= 1:
+            context = self.contexts.get(context_bytes, timer)
+            for chunk in chunks:
+                preds = self.score(context, chunk, timer)
+                yield chunk, preds if isinstance(preds, list) else preds["ciphertexts"]
+            return
+
+        # Workers keep contexts cached by hash and only read the spilled file
+        # on a miss; the request directory is removed once the batch is done
+        key = context_hash(context_bytes)
+        pool = self.pool()
+        pending = deque()
+        with tempfile.TemporaryDirectory(prefix="ppml-request-") as work_dir:
+            context_path = spill_context(context_bytes, work_dir)
+            try:
+                for chunk in chunks:
+                    pending.append((chunk, pool.submit(_score_chunk, key, context_path, chunk)))
+                    if len(pending) >= 2 * self.workers:
+                        chunk, future = pending.popleft()
+                        preds, totals = future.result()
+                        timer.merge(totals)
+                        yield chunk, preds
+                while pending:
+                    chunk, future = pending.popleft()
+                    preds, totals = future.result()
+                    timer.merge(totals)
+                    yield chunk, preds
+            finally:
+                # An abandoned stream must not leave work queued behind it
+                for _, future in pending:
+                    future.cancel()
+
+    def predict(self, batch, context_bytes, timer=NULL_TIMER):
+        return merge_predictions(batch, self.iter_predict(batch, context_bytes, timer))
+
+    def predict_container(self, reader, context_bytes, out_file, units=None, progress=None, sigmoid_degree=None,
+                          timer=NULL_TIMER, **extra):
+        # Score a ciphertext container (optionally only some of its units)
+        # into a prediction container with the same encoding and compression
+        expected_hash = reader.header.get("context_hash")
+        if expected_hash and expected_hash != context_hash(context_bytes):
+            raise ContainerError("Ciphertexts were not encrypted under the provided context")
+        header = self.resolve_header(reader.header, sigmoid_degree)
+        self.check_depth(context_bytes, header, timer)
+        # Record the activation so the client knows it holds probabilities,
+        # and the model behind each part of a multi-model unit
+        activation = {key: header[key] for key in ("activation", "sigmoid_degree", "outputs") if key in header}
+        writer = ContainerWriter(
+            out_file,
+            encoding=reader.encoding,
+            context_hash=expected_hash,
+            compression=reader.compression,
+            parts_per_unit=output_parts(header),
+            **activation,
+            **extra
+        )
+        chunks = timed(chunk_units(header, reader.iter_units(units, raw=True), self.chunk_size), timer, "read")
+        for chunk, preds in self.iter_predict_chunks(chunks, context_bytes, timer):
+            with timer.stage("write"):
+                for n, pred in zip(chunk["rows"], preds):
+                    writer.add_unit(n, pred if isinstance(pred, list) else [pred])
+            if progress is not None:
+                progress(writer.row_count)
+        writer.close()
+        return writer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run encrypted inference on ./output/encrypted_user_data.ppmc")
+    parser.add_argument("--workers", type=int, default=1, help="number of scoring processes")
+    parser.add_argument("--chunk-size", type=int, default=16, help="ciphertexts per scoring task")
+    parser.add_argument("--rows", type=parse_row_range, default=None,
+                        help="only score patient rows start:stop (whole units are scored)")
+    parser.add_argument("--input", default=ENCRYPTED_IN, help="ciphertext container to score")
+    parser.add_argument("--context", default=CONTEXT_PATH, help="client's public context")
+    parser.add_argument("--output", default=ENCRYPTED_OUT, help="where to write the prediction container")
+    parser.add_argument("--sigmoid-degree", type=int, default=None,
+                        help="return encrypted probabilities through a sigmoid polynomial of this degree")
+    args = parser.parse_args()
+
+    # Ensure the context file exists
+    if not os.path.exists(args.context):
+        raise FileNotFoundError(f"CKKS encryption context file not found. Expected at {args.context}")
+
+    # Load encryption context from client-provided file
+    with open(args.context, "rb") as f:
+        context_bytes = f.read()
+
+    engine = InferenceEngine(PARAMS_PATH, workers=args.workers, chunk_size=args.chunk_size)
+    with ContainerReader(args.input) as reader:
+        units, row_offset = None, 0
+        if args.rows is not None:
+            start, stop = args.rows
+            units, row_offset = reader.units_for_rows(start, reader.row_count if stop is None else stop)
+        with open(args.output, "wb") as f:
+            writer = engine.predict_container(reader, context_bytes, f, units=units, row_offset=row_offset,
+                                              sigmoid_degree=args.sigmoid_degree)
+    engine.close()
+
+    print(f"Saved {writer.row_count} encrypted predictions to {args.output}")
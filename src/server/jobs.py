@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.container import ContainerReader
+from common.metrics import StageTimer
+
+# --- Job states ---
+QUEUED  = "queued"
+RUNNING = "running"
+DONE    = "done"
+FAILED  = "failed"
+
+
+class Job:
+    def __init__(self, job_id, work_dir):
+        self.id = job_id
+        self.work_dir = work_dir
+        self.input_path = os.path.join(work_dir, "encrypted_user_data.ppmc")
+        self.context_path = os.path.join(work_dir, "context_public.ckks")
+        self.result_path = os.path.join(work_dir, "encrypted_predictions.ppmc")
+        self.status = QUEUED
+        self.model_version = None
+        self.rows_done = 0
+        self.rows_total = 0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "model_version": self.model_version,
+            "rows_done": self.rows_done,
+            "rows_total": self.rows_total,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished
+        }
+
+
+class JobManager:
+    """In-process queue of encrypted scoring jobs with bounded concurrency."""
+
+    def __init__(self, get_engine, concurrency=2, retention=3600, root_dir=None, observe=None, release=None):
+        # get_engine(model_version) -> inference engine of that version;
+        # release(engine), if given, is called once a job is done with it
+        self.get_engine = get_engine
+        self.release = release
+        # observe(stage timer, encoding) is called after each finished job
+        self.observe = observe
+        self.retention = retention
+        self.root_dir = root_dir or os.path.join(tempfile.gettempdir(), "ppml-jobs")
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ppml-job")
+
+    def create(self):
+        # Allocate a job and its working directory; the caller fills in the
+        # input files and then calls submit()
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, tempfile.mkdtemp(prefix=f"{job_id}-", dir=self.root_dir))
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def submit(self, job, resolve_version=None):
+        # resolve_version(the container's model_version) picks the version
+        # the job is scored with. A job that can't be queued is discarded, so
+        # it never lingers as queued with its files on disk
+        try:
+            with ContainerReader(job.input_path) as reader:
+                reader.check()
+                job.rows_total = reader.row_count
+                if resolve_version is not None:
+                    job.model_version = resolve_version(reader.header.get("model_version"))
+            self._executor.submit(self._run, job)
+        except BaseException:
+            self.discard(job.id)
+            raise
+        return job
+
+    def get(self, job_id):
+        self.cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_count(self):
+        with self._lock:
+            return sum(job.status in (QUEUED, RUNNING) for job in self._jobs.values())
+
+    def discard(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+        return job
+
+    def cleanup(self):
+        # Drop finished jobs (and their files) once they outlive the retention window
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and now - job.finished > self.retention]
+        for job_id in expired:
+            self.discard(job_id)
+
+    def _run(self, job):
+        job.status = RUNNING
+
+        def progress(rows_done):
+            job.rows_done = rows_done
+
+        engine = None
+        try:
+            with open(job.context_path, "rb") as f:
+                context_bytes = f.read()
+            engine = self.get_engine(job.model_version)
+            tmp_path = job.result_path + ".part"
+            timer = StageTimer()
+            with ContainerReader(job.input_path) as reader, open(tmp_path, "wb") as out:
+                engine.predict_container(reader, context_bytes, out, progress=progress, timer=timer,
+                                         model_version=engine.version)
+                encoding = reader.encoding
+            os.replace(tmp_path, job.result_path)
+            job.status = DONE
+            if self.observe is not None:
+                self.observe(timer, encoding)
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            if engine is not None and self.release is not None:
+                self.release(engine)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,73 @@
+import os
+import re
+import hashlib
+import threading
+
+# --- Scoring protocol ---
+# The TenSEAL-free parts of a scoring request: encodings, output layout and
+# registered public contexts. server.py imports these at startup and only
+# loads inference.py (and TenSEAL with it) once it builds an engine.
+ENCODINGS = ("row", "packed", "column")
+
+
+def output_parts(header):
+    # Predictions per unit: one per requested model, or the one model
+    return len(header.get("outputs") or [None])
+
+
+def context_hash(context_bytes):
+    return hashlib.sha256(context_bytes).hexdigest()
+
+
+class ContextStore:
+    """Public contexts registered by clients, kept on disk by SHA-256 so they outlive restarts."""
+
+    _KEY = re.compile(r"[0-9a-f]{64}")
+
+    def __init__(self, root, max_entries=64):
+        self.root = root
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        # Keys come from clients, so only well-formed hashes map to a file
+        if not isinstance(key, str) or not self._KEY.fullmatch(key):
+            return None
+        return os.path.join(self.root, key + ".ckks")
+
+    def __contains__(self, key):
+        path = self.path(key)
+        return path is not None and os.path.exists(path)
+
+    def get(self, key):
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                context_bytes = f.read()
+            # Touch it so pruning drops the least recently used contexts
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return context_bytes
+
+    def put(self, context_bytes):
+        key = context_hash(context_bytes)
+        path = self.path(key)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(context_bytes)
+            os.replace(tmp_path, path)
+            self.prune()
+        return key
+
+    def prune(self):
+        entries = [os.path.join(self.root, name) for name in os.listdir(self.root) if name.endswith(".ckks")]
+        entries.sort(key=lambda path: os.path.getmtime(path))
+        for path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
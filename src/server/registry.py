@@ -0,0 +1,270 @@
+import os
+import re
+import sys
+import pickle
+import argparse
+import shutil
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+
+# --- Model registry ---
+# Each version is a directory holding its params.pkl bundle (weights,
+# intercept, normalization stats and feature transform, plus its own
+# "version"). A CURRENT file names the version new requests are scored with;
+# it is swapped with an atomic rename, and requests already holding an engine
+# finish on the version they started with.
+PARAMS_NAME  = "params.pkl"
+CURRENT_NAME = "CURRENT"
+_VERSION_RE  = re.compile(r"^v(\d+)$")
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class ModelRegistry:
+    """Versioned model bundles with lazily built, cached inference engines."""
+
+    def __init__(self, root, make_engine, max_engines=4, mirror_path=None):
+        self.root = root
+        # make_engine(params_path) -> engine for one version
+        self.make_engine = make_engine
+        self.max_engines = max_engines
+        # Legacy location kept in sync with the current version
+        self.mirror_path = mirror_path
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._engines = OrderedDict()
+        # Requests holding each engine, and evicted engines that are closed
+        # once the last of them releases it
+        self._users = {}
+        self._retired = set()
+        self._etags = {}
+        self._bundles = {}
+        self._current = self._read_current()
+        self._training = None
+        self.last_error = None
+
+    # --- Versions on disk ---
+
+    def path(self, version):
+        if not isinstance(version, str) or not _VERSION_RE.match(version):
+            raise KeyError(version)
+        return os.path.join(self.root, version, PARAMS_NAME)
+
+    def versions(self):
+        found = [name for name in os.listdir(self.root)
+                 if _VERSION_RE.match(name) and os.path.exists(os.path.join(self.root, name, PARAMS_NAME))]
+        return sorted(found, key=lambda name: int(name[1:]))
+
+    def __contains__(self, version):
+        try:
+            return os.path.exists(self.path(version))
+        except KeyError:
+            return False
+
+    @property
+    def current(self):
+        return self._current
+
+    def _read_current(self):
+        path = os.path.join(self.root, CURRENT_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            version = f.read().strip()
+        return version if version in self else None
+
+    def etag(self, version):
+        # Content hash of the bundle; versions are immutable, so it is cached
+        etag = self._etags.get(version)
+        if etag is None:
+            with open(self.path(version), "rb") as f:
+                etag = hashlib.sha256(f.read()).hexdigest()
+            self._etags[version] = etag
+        return etag
+
+    def bundle(self, version):
+        # Loaded params bundle of a version, cached like its etag
+        model_bundle = self._bundles.get(version)
+        if model_bundle is None:
+            if version not in self:
+                raise KeyError(version)
+            with open(self.path(version), "rb") as f:
+                model_bundle = self._bundles[version] = pickle.load(f)
+        return model_bundle
+
+    def publish(self, params_path, activate=True):
+        # Copy a trained bundle in as the next version, stamped with its
+        # version so clients encrypting with it can pin it
+        with open(params_path, "rb") as f:
+            model_bundle = pickle.load(f)
+        with self._lock:
+            existing = self.versions()
+            version = f"v{int(existing[-1][1:]) + 1 if existing else 1}"
+            # Write into a scratch directory and rename it, so a crash never
+            # leaves a half-written version behind
+            version_dir = os.path.join(self.root, version)
+            tmp_dir = version_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            with open(os.path.join(tmp_dir, PARAMS_NAME), "wb") as f:
+                pickle.dump({**model_bundle, "version": version}, f)
+            os.replace(tmp_dir, version_dir)
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        # Load the engine first, then switch; a broken bundle never goes live
+        self.engine(version)
+        with self._lock:
+            tmp_path = os.path.join(self.root, CURRENT_NAME + ".tmp")
+            with open(tmp_path, "w") as f:
+                f.write(version)
+            os.replace(tmp_path, os.path.join(self.root, CURRENT_NAME))
+            self._current = version
+        if self.mirror_path is not None:
+            tmp_path = self.mirror_path + ".tmp"
+            shutil.copyfile(self.path(version), tmp_path)
+            os.replace(tmp_path, self.mirror_path)
+        return version
+
+    # --- Engines ---
+
+    def resolve(self, version=None):
+        # The pinned version, or the current one
+        if version is None:
+            version = self._current
+            if version is None:
+                raise ModelUnavailable("No model has been trained yet" +
+                                       (" (training is running)" if self.training else ""))
+        if version not in self:
+            raise KeyError(version)
+        return version
+
+    def engine(self, version=None, hold=False):
+        # Resident engine of a version, building it on first use; the least
+        # recently used one is dropped once more than max_engines are loaded.
+        # With hold, the caller must release() the engine when done with it
+        version = self.resolve(version)
+        with self._lock:
+            engine = self._engines.get(version)
+            if engine is not None:
+                self._engines.move_to_end(version)
+                if hold:
+                    self._users[engine] = self._users.get(engine, 0) + 1
+                return engine
+        engine = self.make_engine(self.path(version))
+        engine.version = version
+        to_close = []
+        with self._lock:
+            # Another thread may have built it meanwhile; keep the first one
+            kept = self._engines.setdefault(version, engine)
+            if kept is not engine:
+                to_close.append(engine)
+                engine = kept
+            self._engines.move_to_end(version)
+            if hold:
+                self._users[engine] = self._users.get(engine, 0) + 1
+            # Never drop the live model's engine; one still held by requests
+            # is closed when the last of them releases it
+            stale = [v for v in self._engines if v not in (self._current, version)]
+            for evicted in stale[:max(len(self._engines) - self.max_engines, 0)]:
+                retired = self._engines.pop(evicted)
+                if self._users.get(retired):
+                    self._retired.add(retired)
+                else:
+                    to_close.append(retired)
+        for retired in to_close:
+            retired.close()
+        return engine
+
+    def release(self, engine):
+        # Drop a hold taken with engine(hold=True)
+        with self._lock:
+            users = self._users.get(engine, 0) - 1
+            if users > 0:
+                self._users[engine] = users
+                return
+            self._users.pop(engine, None)
+            if engine not in self._retired:
+                return
+            self._retired.discard(engine)
+        engine.close()
+
+    def close(self):
+        # Shut down the resident and retired engines' scoring workers
+        with self._lock:
+            engines = list(self._engines.values()) + list(self._retired)
+            self._engines.clear()
+            self._retired.clear()
+        for engine in engines:
+            engine.close()
+
+    def loaded(self, version):
+        # Whether the version's engine is resident, i.e. requests won't build it
+        with self._lock:
+            return version in self._engines
+
+    # --- Background training ---
+
+    @property
+    def training(self):
+        return self._training is not None and self._training.is_alive()
+
+    def train_async(self, train):
+        # Run train() in a background thread; it publishes the new version
+        # itself. Returns False if a training run is already in progress
+        with self._lock:
+            if self._training is not None and self._training.is_alive():
+                return False
+
+            def run():
+                try:
+                    version = train()
+                    self.last_error = None
+                    print(f"✅ Model {version} is live.")
+                except Exception as e:
+                    self.last_error = str(e)
+                    traceback.print_exc()
+
+            self._training = threading.Thread(target=run, name="ppml-train", daemon=True)
+            self._training.start()
+        return True
+
+    def status(self):
+        return {
+            "current": self._current,
+            "versions": self.versions(),
+            "training": self.training,
+            "last_error": self.last_error
+        }
+
+
+if __name__ == "__main__":
+    # Offline registry management, e.g. adding a model trained on other data
+    # (train.py --data ... --params-out ...) so requests can score it next to
+    # the live one. A running server picks new versions up on first use;
+    # switch the live model through POST /models/{version}/activate
+    parser = argparse.ArgumentParser(description="List or publish versions in the model registry")
+    parser.add_argument("--root", default=os.environ.get("PPML_MODEL_DIR", "output/models"),
+                        help="registry directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="show the versions and the live one")
+    publish_parser = subparsers.add_parser("publish", help="add a params.pkl bundle as the next version")
+    publish_parser.add_argument("params", help="params.pkl written by train.py")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root, make_engine=None)
+    if args.command == "publish":
+        try:
+            version = registry.publish(args.params, activate=False)
+        except (OSError, pickle.UnpicklingError) as e:
+            sys.exit(f"Can't publish {args.params}: {e}")
+        print(f"Published {args.params} as {version}")
+    else:
+        for version in registry.versions():
+            print(version + (" (current)" if version == registry.current else ""))
@@ -1,67 +1,556 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
-import uvicorn
+import time
+# Cold-start clock: this module's imports count against the startup budget
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 import os
+import sys
+import io
+import shutil
+import pickle
+import tempfile
+import threading
+import traceback
 import subprocess
 
-app = FastAPI()
+from protocol import ContextStore, ENCODINGS, context_hash, output_parts
+from jobs import JobManager, DONE
+from registry import ModelRegistry, ModelUnavailable
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import framing
+from common.container import ContainerReader, ContainerError, MAGIC as CONTAINER_MAGIC
+from common.metrics import MetricsRegistry, StageTimer, timed
 
 # --- Path Configuration ---
 BASE_DIR      = os.path.dirname(__file__)
 PARAMS_PATH   = os.path.join(BASE_DIR, "output/params.pkl")
-CONTEXT_PATH  = os.path.join(BASE_DIR, "output/context_public.ckks")
 MODEL_FILE    = os.path.join(BASE_DIR, "trained_model.pkl")
-ENCRYPTED_IN  = os.path.join(BASE_DIR, "output/encrypted_user_data.pkl")
-ENCRYPTED_OUT = os.path.join(BASE_DIR, "output/encrypted_predictions.pkl")
+CONTEXT_CACHE_SIZE = int(os.environ.get("PPML_CONTEXT_CACHE_SIZE", "8"))
+INFERENCE_WORKERS  = int(os.environ.get("PPML_INFERENCE_WORKERS", "1"))
+# Sigmoid polynomial degree for clients that ask for probabilities without picking one
+SIGMOID_DEGREE     = int(os.environ.get("PPML_SIGMOID_DEGREE", "5"))
+SIGMOID_BOUND      = float(os.environ.get("PPML_SIGMOID_BOUND", "10"))
+# Unpickling an upload runs whatever code it names, so the pickled batches
+# of old clients are only accepted on trusted deployments that opt in
+ALLOW_PICKLE       = os.environ.get("PPML_ALLOW_PICKLE", "0") == "1"
+# Framed uploads larger than this are spooled to disk instead of memory
+SPOOL_MAX_MEMORY   = int(os.environ.get("PPML_SPOOL_MAX_MEMORY", str(16 * 1024 * 1024)))
 
-def ensure_model():
-    # If model or parameters are missing, retrain
-    if not os.path.exists(MODEL_FILE) or not os.path.exists(PARAMS_PATH):
+# Background scoring jobs
+JOB_CONCURRENCY    = int(os.environ.get("PPML_JOB_CONCURRENCY", "2"))
+JOB_RETENTION      = int(os.environ.get("PPML_JOB_RETENTION", "3600"))
+JOB_DIR            = os.environ.get("PPML_JOB_DIR")
+
+# Versioned models; CURRENT in the registry names the live one
+MODEL_DIR          = os.environ.get("PPML_MODEL_DIR", os.path.join(BASE_DIR, "output/models"))
+MODEL_ENGINES      = int(os.environ.get("PPML_MODEL_ENGINES", "4"))
+
+# Public contexts registered through /contexts/, so clients upload them once
+CONTEXT_DIR        = os.environ.get("PPML_CONTEXT_DIR", os.path.join(BASE_DIR, "output/contexts"))
+CONTEXT_STORE_SIZE = int(os.environ.get("PPML_CONTEXT_STORE_SIZE", "64"))
+
+# Seconds from importing this module until it accepts connections (checked
+# at startup; benchmark.py --cold-starts times it from process start). The
+# model warms up in the background after that, see /readyz
+STARTUP_BUDGET     = float(os.environ.get("PPML_STARTUP_BUDGET", "1.0"))
+
+# --- Metrics ---
+# Served at /metrics in the Prometheus text format. Scoring requests and jobs
+# each fill a StageTimer (upload, context, read, parse, evaluate, serialize,
+# write) that is folded into the stage histogram when they finish
+metrics = MetricsRegistry()
+REQUESTS         = metrics.counter("ppml_requests_total", "HTTP requests by route and status",
+                                   ("route", "method", "status"))
+REQUEST_SECONDS  = metrics.histogram("ppml_request_seconds", "HTTP request latency until the response starts",
+                                     ("route",))
+IN_FLIGHT        = metrics.gauge("ppml_requests_in_flight", "HTTP requests being handled")
+STAGE_SECONDS    = metrics.histogram("ppml_stage_seconds", "Time a scoring request or job spent per pipeline stage",
+                                     ("stage",))
+ROWS_SCORED      = metrics.counter("ppml_rows_scored_total", "Patient rows scored", ("encoding",))
+BYTES_IN         = metrics.counter("ppml_bytes_in_total", "Ciphertext and context bytes received", ("route",))
+BYTES_OUT        = metrics.counter("ppml_bytes_out_total", "Encrypted prediction bytes sent", ("route",))
+CONTEXT_LOOKUPS  = metrics.counter("ppml_context_cache_lookups_total",
+                                   "Parsed-context cache lookups (per scoring process)", ("result",))
+STORE_LOOKUPS    = metrics.counter("ppml_context_store_lookups_total",
+                                   "Registered-context lookups by hash", ("result",))
+
+
+def hit_ratio(counter):
+    hits, misses = counter.value(result="hit"), counter.value(result="miss")
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+metrics.gauge("ppml_context_cache_hit_ratio", "Share of parsed-context lookups served from cache",
+              callback=lambda: hit_ratio(CONTEXT_LOOKUPS))
+metrics.gauge("ppml_context_store_hit_ratio", "Share of registered-context lookups that found the context",
+              callback=lambda: hit_ratio(STORE_LOOKUPS))
+metrics.gauge("ppml_active_jobs", "Queued and running scoring jobs", callback=lambda: jobs.active_count())
+
+
+def record_timer(timer, encoding):
+    # Fold a finished request's or job's stage timings into the metrics
+    seconds, counts = timer.totals()
+    for stage, value in seconds.items():
+        STAGE_SECONDS.observe(value, stage=stage)
+    if counts.get("rows"):
+        ROWS_SCORED.inc(counts["rows"], encoding=encoding or "row")
+    for result in ("hit", "miss"):
+        if counts.get(f"context_cache_{result}"):
+            CONTEXT_LOOKUPS.inc(counts[f"context_cache_{result}"], result=result)
+
+
+def upload_time(request, timer):
+    # Multipart bodies are received and parsed before the handler runs, so
+    # the upload is the time from the request's arrival until now
+    timer.add("upload", time.perf_counter() - request.state.started)
+
+
+def make_engine(params_path):
+    # Imported here so TenSEAL loads during warmup, not at startup. Requests
+    # may ask for other registered versions to be scored alongside
+    from inference import InferenceEngine
+
+    return InferenceEngine(params_path, cache_size=CONTEXT_CACHE_SIZE, workers=INFERENCE_WORKERS,
+                           sigmoid_degree=SIGMOID_DEGREE, sigmoid_bound=SIGMOID_BOUND,
+                           model_source=lambda version: models.bundle(version))
+
+
+# Resident inference engines, one per recently used model version
+models = ModelRegistry(MODEL_DIR, make_engine, max_engines=MODEL_ENGINES, mirror_path=PARAMS_PATH)
+
+
+def train_model():
+    # Train into a scratch directory and publish the result as the next
+    # version; requests keep being served by the current one meanwhile
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="training-", dir=MODEL_DIR)
+    try:
         print("⏳ Training model and generating params...")
         result = subprocess.run(
-            ["python", "train.py"],
+            ["python", "train.py",
+             "--model-file", os.path.join(work_dir, "trained_model.pkl"),
+             "--params-out", os.path.join(work_dir, "params.pkl")],
             cwd=os.path.join(BASE_DIR),
             capture_output=True,
             text=True
         )
         if result.returncode != 0:
             raise RuntimeError(f"Training failed:\n{result.stderr}")
-        print("✅ Training complete.")
+        version = models.publish(os.path.join(work_dir, "params.pkl"))
+        os.replace(os.path.join(work_dir, "trained_model.pkl"), MODEL_FILE)
+        return version
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def ensure_model():
+    # Serve the registry's current model; adopt a model trained before the
+    # registry existed, or train the first one in the background
+    if models.current is not None:
+        return
+    versions = models.versions()
+    if versions:
+        models.activate(versions[-1])
+    elif os.path.exists(MODEL_FILE) and os.path.exists(PARAMS_PATH):
+        models.publish(PARAMS_PATH)
+    else:
+        models.train_async(train_model)
+
+
+def warm_up():
+    # Adopt or train the live model and build its engine (and scoring
+    # workers), so the first request doesn't pay for loading it
+    started = time.perf_counter()
+    try:
+        ensure_model()
+        if models.current is not None:
+            models.engine().warm_up()
+    except Exception as e:
+        startup["error"] = str(e)
+        traceback.print_exc()
+    finally:
+        startup["warmup_seconds"] = time.perf_counter() - started
+        STARTUP_SECONDS.set(startup["warmup_seconds"], phase="warmup")
+    if models.current is not None and startup["error"] is None:
+        print(f"✅ Model {models.current} warmed up in {startup['warmup_seconds']:.2f}s.")
+
+
+def is_ready():
+    # Warmup finished and the live model's engine is resident; a first
+    # model still being trained keeps the replica unready
+    return (startup["warmup_seconds"] is not None and startup["error"] is None
+            and models.current is not None and models.loaded(models.current))
+
+
+def get_engine(version=None, hold=False):
+    # Engine of the pinned model version, or of the current one; a held
+    # engine must be handed back with models.release()
+    try:
+        return models.engine(version, hold=hold)
+    except KeyError:
+        raise HTTPException(404, detail=f"Unknown model version {version!r}")
+    except ModelUnavailable as e:
+        raise HTTPException(503, detail=str(e), headers={"Retry-After": "10"})
+
+
+jobs = JobManager(lambda version: models.engine(version, hold=True), release=models.release, observe=record_timer, concurrency=JOB_CONCURRENCY, retention=JOB_RETENTION, root_dir=JOB_DIR)
+contexts = ContextStore(CONTEXT_DIR, max_entries=CONTEXT_STORE_SIZE)
+
+# --- Startup ---
+# Importing this module only builds the app, so a new replica takes
+# connections right away; loading the model happens in warm_up() on a
+# background thread. /healthz answers as soon as the process serves, /readyz
+# only once the model is warm, so load balancers route traffic to warm replicas
+startup = {"import_seconds": None, "warmup_seconds": None, "error": None}
+STARTUP_SECONDS = metrics.gauge("ppml_startup_seconds", "Cold-start time by phase (import, warmup)", ("phase",))
+metrics.gauge("ppml_ready", "Whether the live model is warm", callback=lambda: int(is_ready()))
+
 
+@asynccontextmanager
+async def lifespan(app):
+    startup["import_seconds"] = time.perf_counter() - IMPORT_STARTED
+    STARTUP_SECONDS.set(startup["import_seconds"], phase="import")
+    if startup["import_seconds"] > STARTUP_BUDGET:
+        print(f"⚠️ Startup took {startup['import_seconds']:.2f}s, over the {STARTUP_BUDGET:.2f}s budget.")
+    threading.Thread(target=warm_up, name="ppml-warmup", daemon=True).start()
+    yield
+    # Scoring workers don't exit with the server on their own
+    jobs.shutdown()
+    models.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def resolve_context(context_bytes, key):
+    # Use the uploaded public context, or the registered one named by `key`
+    if context_bytes:
+        return context_bytes
+    if not key:
+        raise HTTPException(400, detail="Missing context: upload it or pass a registered context_hash")
+    context_bytes = contexts.get(key)
+    STORE_LOOKUPS.inc(result="miss" if context_bytes is None else "hit")
+    if context_bytes is None:
+        raise HTTPException(409, detail=f"Unknown context {key}; register it with POST /contexts/ first")
+    return context_bytes
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    request.state.started = time.perf_counter()
+    IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+    finally:
+        IN_FLIGHT.dec()
+    # Label by route template so job ids and hashes don't explode the series
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - request.state.started, route=route)
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    ready = is_ready()
+    body = {
+        "ready": ready,
+        "model_version": models.current,
+        "training": models.training,
+        "error": startup["error"] or models.last_error,
+        "import_seconds": startup["import_seconds"],
+        "warmup_seconds": startup["warmup_seconds"],
+        "startup_budget_seconds": STARTUP_BUDGET
+    }
+    if not ready:
+        return JSONResponse(body, status_code=503, headers={"Retry-After": "1"})
+    return body
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=MetricsRegistry.CONTENT_TYPE)
 
 @app.get("/params/")
-async def get_params():
-    if not os.path.exists(PARAMS_PATH):
-        raise HTTPException(500, detail="params.pkl not found")
-    return FileResponse(PARAMS_PATH, media_type="application/octet-stream", filename="params.pkl")
+async def get_params(request: Request, model_version: str = None):
+    # The bundle clients normalize and expand features with; the ETag lets
+    # them skip the download when they already hold this version
+    engine = get_engine(model_version)
+    etag = f'"{models.etag(engine.version)}"'
+    headers = {"ETag": etag, "X-Model-Version": engine.version, "Cache-Control": "no-cache"}
+    if_none_match = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in if_none_match or "*" in if_none_match:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(models.path(engine.version), media_type="application/octet-stream", filename="params.pkl",
+                        headers=headers)
+
+@app.get("/models/")
+async def list_models():
+    return models.status()
+
+@app.post("/models/train", status_code=202)
+async def retrain_model():
+    # Train a new version in the background; it goes live once it loads
+    if not models.train_async(train_model):
+        raise HTTPException(409, detail="Training is already running")
+    return models.status()
+
+@app.post("/models/{version}/activate")
+async def activate_model(version: str):
+    # Roll forward or back to a published version
+    if version not in models:
+        raise HTTPException(404, detail=f"Unknown model version {version!r}")
+    await run_in_threadpool(models.activate, version)
+    return models.status()
+
+@app.get("/contexts/{key}")
+async def context_status(key: str):
+    # Handshake: clients ask before uploading a multi-megabyte public context
+    if key not in contexts:
+        raise HTTPException(404, detail="Context not registered")
+    return {"context_hash": key}
+
+@app.post("/contexts/")
+async def register_context(context: UploadFile = File(...)):
+    context_bytes = await context.read()
+
+    def check_and_store():
+        # Parse it once: this rejects garbage and secret keys, and leaves the
+        # context warm in the engine's cache for the first request
+        import tenseal as ts
+
+        try:
+            parsed = ts.context_from(context_bytes)
+        except Exception as e:
+            raise HTTPException(400, detail=f"Invalid context: {e}")
+        if parsed.is_private():
+            raise HTTPException(400, detail="Refusing a context that contains the secret key")
+        key = contexts.put(context_bytes)
+        if models.current is not None:
+            get_engine().contexts.put(key, parsed)
+        return key
+
+    return {"context_hash": await run_in_threadpool(check_and_store)}
 
 @app.post("/predict/")
-async def predict(encrypted: UploadFile = File(...), context: UploadFile = File(...)):
-    ensure_model()
-
-    # 1. Save uploaded encrypted data
-    with open(ENCRYPTED_IN, "wb") as f:
-        f.write(await encrypted.read())
-
-    # 2. Save the client's public context
-    with open(CONTEXT_PATH, "wb") as f:
-        f.write(await context.read())
-
-    # 3. Run inference
-    result = subprocess.run(
-        ["python", "inference.py"],
-        cwd=os.path.join(BASE_DIR),
-        capture_output=True,
-        text=True
-    )
-    if result.returncode != 0:
-        raise HTTPException(500, detail=f"Inference failed:\n{result.stderr}")
+async def predict(request: Request, encrypted: UploadFile = File(...), context: UploadFile = File(None),
+                  context_key: str = Form(None, alias="context_hash"), model_version: str = None):
+    timer = StageTimer()
+    # 1. Read the uploaded encrypted data and the client's public context,
+    # unless it names one registered through /contexts/
+    payload = await encrypted.read()
+    context_bytes = await context.read() if context is not None else None
+    upload_time(request, timer)
+    BYTES_IN.inc(len(payload) + len(context_bytes or b""), route="/predict/")
+
+    # 2. Ciphertext containers are scored into a prediction container
+    if payload.startswith(CONTAINER_MAGIC):
+        def score_container():
+            out = io.BytesIO()
+            with ContainerReader(payload) as reader:
+                key = context_key or reader.header.get("context_hash")
+                # Containers name the model version their features were prepared for
+                inference_engine = get_engine(model_version or reader.header.get("model_version"), hold=True)
+                try:
+                    inference_engine.predict_container(reader, resolve_context(context_bytes, key), out,
+                                                       timer=timer, model_version=inference_engine.version)
+                finally:
+                    models.release(inference_engine)
+                encoding = reader.encoding
+            record_timer(timer, encoding)
+            return out.getvalue()
+
+        try:
+            content = await run_in_threadpool(score_container)
+        except ContainerError as e:
+            raise HTTPException(400, detail=str(e))
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(500, detail=f"Inference failed:\n{e}")
+        BYTES_OUT.inc(len(content), route="/predict/")
+        return Response(
+            content,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="encrypted_predictions.ppmc"'}
+        )
+
+    # 3. Legacy pickle uploads (opt-in): run inference in-process, off the event loop
+    if not ALLOW_PICKLE:
+        raise HTTPException(400, detail="Expected a ciphertext container; pickled batches are not accepted")
+    try:
+        batch = pickle.loads(payload)
+    except (pickle.UnpicklingError, EOFError, TypeError, ValueError, AttributeError, ImportError, IndexError) as e:
+        raise HTTPException(400, detail=f"Invalid pickled batch: {e}")
+    if not isinstance(batch, (list, dict)) or (isinstance(batch, dict) and "ciphertexts" not in batch):
+        raise HTTPException(400, detail="Invalid pickled batch: expected a list of ciphertexts or a batch dict")
+    context_bytes = resolve_context(context_bytes, context_key)
+    inference_engine = get_engine(model_version, hold=True)
+    try:
+        try:
+            batch_header = inference_engine.resolve_header(batch if isinstance(batch, dict) else {})
+            await run_in_threadpool(inference_engine.check_depth, context_bytes, batch_header, timer)
+        except ContainerError as e:
+            raise HTTPException(400, detail=str(e))
+        if isinstance(batch, dict):
+            # Score with the settled request (activation, models and their
+            # weights) rather than what the client sent
+            batch = batch_header
+        try:
+            all_preds = await run_in_threadpool(inference_engine.predict, batch, context_bytes, timer)
+        except Exception as e:
+            raise HTTPException(500, detail=f"Inference failed:\n{e}")
+    finally:
+        models.release(inference_engine)
+    if isinstance(all_preds, dict):
+        all_preds.pop("output_weights", None)
+    with timer.stage("write"):
+        content = pickle.dumps(all_preds)
+    record_timer(timer, batch_header.get("encoding"))
+    BYTES_OUT.inc(len(content), route="/predict/")
 
     # 4. Return encrypted predictions
-    if not os.path.exists(ENCRYPTED_OUT):
-        raise HTTPException(500, detail="Encrypted predictions not found.")
-    return FileResponse(ENCRYPTED_OUT, media_type="application/octet-stream", filename="encrypted_predictions.pkl")
+    return Response(
+        content,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": 'attachment; filename="encrypted_predictions.pkl"'}
+    )
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request, model_version: str = None):
+    timer = StageTimer()
+
+    # 1. Spool the framed upload so memory stays bounded by the spool size
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    with timer.stage("upload"):
+        async for chunk in request.stream():
+            spool.write(chunk)
+    BYTES_IN.inc(spool.tell(), route="/predict/stream")
+    spool.seek(0)
+
+    # 2. Read the context and header frames that precede the units
+    frames = framing.read_frames(spool)
+    context_bytes, header, inference_engine = None, None, None
+    try:
+        for kind, payload in frames:
+            if kind == framing.KIND_CONTEXT:
+                context_bytes = payload
+            elif kind == framing.KIND_HEADER:
+                header = framing.decode_header(payload)
+                break
+            else:
+                raise framing.FrameError("Unit frame before the header")
+        if header is None:
+            raise framing.FrameError("Missing header frame")
+        if header.get("encoding") not in ENCODINGS:
+            raise framing.FrameError(f"Unsupported encoding: {header.get('encoding')!r}")
+        # Without a context frame the header's hash names a registered context
+        context_bytes = resolve_context(context_bytes, header.get("context_hash"))
+        if header.get("context_hash") and header["context_hash"] != context_hash(context_bytes):
+            raise framing.FrameError("Ciphertexts were not encrypted under the provided context")
+        # Held until the stream below finishes
+        inference_engine = get_engine(model_version or header.get("model_version"), hold=True)
+        header = inference_engine.resolve_header(header)
+        await run_in_threadpool(inference_engine.check_depth, context_bytes, header, timer)
+    except (framing.FrameError, ContainerError, HTTPException) as e:
+        spool.close()
+        if inference_engine is not None:
+            models.release(inference_engine)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(400, detail=str(e))
+
+    # 3. Score and emit predictions chunk by chunk; a failure mid-stream
+    # truncates the response before the END frame
+    def stream():
+        sent = 0
+        try:
+            yield framing.MAGIC
+            # The models' weights stay on the server
+            public = {key: value for key, value in header.items() if key != "output_weights"}
+            yield framing.encode_header({**public, "parts_per_unit": output_parts(header),
+                                         "model_version": inference_engine.version})
+            chunks = timed(framing.iter_batches(header, frames, inference_engine.chunk_size), timer, "read")
+            for chunk, preds in inference_engine.iter_predict_chunks(chunks, context_bytes, timer):
+                with timer.stage("write"):
+                    units = [framing.encode_unit(n, framing.compress_parts(pred if isinstance(pred, list) else [pred],
+                                                                           header))
+                             for n, pred in zip(chunk["rows"], preds)]
+                for unit in units:
+                    sent += len(unit)
+                    yield unit
+            yield framing.encode_end()
+            record_timer(timer, header.get("encoding"))
+        finally:
+            BYTES_OUT.inc(sent, route="/predict/stream")
+            spool.close()
+            models.release(inference_engine)
+
+    return StreamingResponse(stream(), media_type=framing.MEDIA_TYPE)
+
+@app.post("/jobs/")
+async def submit_job(request: Request, encrypted: UploadFile = File(...), context: UploadFile = File(None),
+                     context_key: str = Form(None, alias="context_hash"), model_version: str = None):
+    # Store the upload in the job's directory and return right away;
+    # scoring runs on the job queue
+    if context is None:
+        context_bytes = resolve_context(None, context_key)
+    job = jobs.create()
+    try:
+        with open(job.input_path, "wb") as f:
+            await run_in_threadpool(shutil.copyfileobj, encrypted.file, f)
+        with open(job.context_path, "wb") as f:
+            if context is None:
+                f.write(context_bytes)
+            else:
+                await run_in_threadpool(shutil.copyfileobj, context.file, f)
+    except BaseException:
+        jobs.discard(job.id)
+        raise
+    # Only what came over the wire; a registered context is read from the store
+    received = os.path.getsize(job.input_path) + (0 if context is None else os.path.getsize(job.context_path))
+
+    try:
+        # Jobs are pinned to a model version when submitted, so a swap while
+        # they wait in the queue doesn't change which model scores them;
+        # submit() discards the job if this fails
+        jobs.submit(job, lambda header_version: get_engine(model_version or header_version).version)
+    except ContainerError as e:
+        raise HTTPException(400, detail=str(e))
+    BYTES_IN.inc(received, route="/jobs/")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, detail="Job not found")
+    if job.status != DONE:
+        raise HTTPException(409, detail=f"Job is {job.status}")
+    BYTES_OUT.inc(os.path.getsize(job.result_path), route="/jobs/{job_id}/result")
+    return FileResponse(job.result_path, media_type="application/octet-stream", filename="encrypted_predictions.ppmc")
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    if jobs.discard(job_id) is None:
+        raise HTTPException(404, detail="Job not found")
+    return {"job_id": job_id, "status": "deleted"}
 
-ensure_model()
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,75 +1,192 @@
-import tenseal as ts
 import pandas as pd
 import numpy as np
 import pickle
 import os
+import argparse
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.exceptions import ConvergenceWarning
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import matthews_corrcoef
 from sklearn.preprocessing import PolynomialFeatures
 
-# Load training data
-data = pd.read_csv("./data/diabetes.csv")
-X = data.drop(columns=["Outcome"]).values
-y = data["Outcome"].values
+DATA_PATH   = "./data/diabetes.csv"
+MODEL_FILE  = "trained_model.pkl"
+PARAMS_PATH = "output/params.pkl"
 
-# Normalize data
-X_mean = np.mean(X, axis=0)
-X_std = np.std(X, axis=0)
-X = (X - X_mean) / X_std
+# --- Federated averaging ---
+# Each round every client shard starts from the global weights, runs a few
+# local solver iterations and the server averages the results weighted by
+# shard size. Training stops once a round moves the weights less than TOL.
+N_CLIENTS   = int(os.environ.get("PPML_TRAIN_CLIENTS", "1"))
+NUM_ROUNDS  = 70
+LOCAL_ITERS = 100
+TOL         = 1e-4
 
-# Polynomial expansion
-poly = PolynomialFeatures(degree=2, include_bias=False)
-X_poly = poly.fit_transform(X)
 
-# Split into federated clients
-n_clients = 1 # No federeated learning for now
-X_clients = np.array_split(X_poly, n_clients)
-y_clients = np.array_split(y, n_clients)
+def load_training_data(path=DATA_PATH):
+    data = pd.read_csv(path)
+    X = data.drop(columns=["Outcome"]).values
+    y = data["Outcome"].values
+    return X, y
 
-# Federated Training
-model_file = "trained_model.pkl"
-if os.path.exists(model_file):
+
+def fit_local(X_client, y_client, weights, intercept, local_iters=LOCAL_ITERS):
+    # Warm-start the client's solver from the global model instead of from zero
+    model = LogisticRegression(max_iter=local_iters, warm_start=True)
+    model.coef_ = weights.reshape(1, -1).copy()
+    model.intercept_ = np.array([intercept], dtype=np.float64)
+    with warnings.catch_warnings():
+        # A capped local solve is expected to stop before convergence
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        model.fit(X_client, y_client)
+    return model.coef_[0], model.intercept_[0]
+
+
+# --- Pool worker state ---
+# Shards are sent to each worker once; rounds only ship the global weights
+_worker_shards = None
+
+
+def _init_worker(X_clients, y_clients):
+    global _worker_shards
+    _worker_shards = list(zip(X_clients, y_clients))
+
+
+def _fit_shard(idx, weights, intercept, local_iters):
+    X_client, y_client = _worker_shards[idx]
+    return fit_local(X_client, y_client, weights, intercept, local_iters)
+
+
+def federated_train(X_clients, y_clients, num_rounds=NUM_ROUNDS, local_iters=LOCAL_ITERS, tol=TOL, workers=1):
+    # Return (global weights, global intercept, rounds run)
+    sizes = np.array([len(y_client) for y_client in y_clients], dtype=np.float64)
+    global_weights = np.zeros(X_clients[0].shape[1])
+    global_intercept = 0.0
+    epoch = 0
+
+    pool = None
+    if workers > 1 and len(X_clients) > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=min(workers, len(X_clients)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(X_clients, y_clients)
+        )
     try:
-        with open(model_file, "rb") as f:
-            model = f.read()
-        global_weights, global_intercept = pickle.loads(model)
-        print("Loaded pre-trained model.")
-    except (pickle.UnpicklingError, Exception):
-        print("Invalid model file. Training new model...")
-        os.remove(model_file)
-        train_new_model = True
+        for epoch in range(1, num_rounds + 1):
+            if pool is None:
+                updates = [fit_local(X_client, y_client, global_weights, global_intercept, local_iters)
+                           for X_client, y_client in zip(X_clients, y_clients)]
+            else:
+                futures = [pool.submit(_fit_shard, idx, global_weights, global_intercept, local_iters)
+                           for idx in range(len(X_clients))]
+                updates = [future.result() for future in futures]
+
+            weights = np.average([w for w, _ in updates], axis=0, weights=sizes)
+            intercept = np.average([b for _, b in updates], weights=sizes)
+            change = max(np.max(np.abs(weights - global_weights)), abs(intercept - global_intercept))
+            global_weights, global_intercept = weights, intercept
+            if change < tol:
+                print(f"Converged after {epoch} rounds.")
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return global_weights, global_intercept, epoch
+
+
+# --- Out-of-core training ---
+# For corpora that don't fit in memory: one chunked pass for the mean and
+# std, then Newton steps on the same objective LogisticRegression minimizes
+# (log-loss + 0.5 * ||w||^2), each accumulating the gradient and Hessian
+# chunk by chunk. Memory is bounded by the chunk size and the (features + 1)^2
+# Hessian, and the result matches the in-memory fit.
+CHUNK_ROWS   = 65536
+NEWTON_STEPS = 25
+
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS):
+    # Yield (X, y) chunks of a CSV or SAS transport (.xpt) file
+    if path.lower().endswith(".xpt"):
+        reader = pd.read_sas(path, format="xport", chunksize=chunk_rows)
     else:
-        train_new_model = False
-else:
-    print("No pre-trained model found. Training a new one...")
-    train_new_model = True
+        reader = pd.read_csv(path, chunksize=chunk_rows)
+    with reader:
+        for df in reader:
+            yield df.drop(columns=["Outcome"]).values.astype(np.float64), df["Outcome"].values
 
-if train_new_model:
-    global_weights = np.zeros(X_poly.shape[1])
-    global_intercept = 0
-    num_epochs = 70
 
-    for epoch in range(num_epochs):
-        weight_updates = []
-        intercept_updates = []
+def stream_stats(path, chunk_rows=CHUNK_ROWS):
+    # Per-column mean and population std in one pass, merging chunk moments
+    n, mean, m2 = 0, None, None
+    for X, _ in iter_chunks(path, chunk_rows):
+        k = len(X)
+        chunk_mean = X.mean(axis=0)
+        chunk_m2 = ((X - chunk_mean) ** 2).sum(axis=0)
+        if mean is None:
+            n, mean, m2 = k, chunk_mean, chunk_m2
+            continue
+        delta = chunk_mean - mean
+        total = n + k
+        mean = mean + delta * k / total
+        m2 = m2 + chunk_m2 + delta ** 2 * n * k / total
+        n = total
+    if mean is None:
+        raise ValueError(f"No training rows in {path}")
+    return mean, np.sqrt(m2 / n)
 
-        for X_client, y_client in zip(X_clients, y_clients):
-            model = LogisticRegression(max_iter=1000)
-            model.fit(X_client, y_client)
 
-            weights = model.coef_[0]
-            intercept = model.intercept_[0]
+def iter_poly_chunks(path, X_mean, X_std, poly, chunk_rows=CHUNK_ROWS):
+    # Normalize and expand chunk by chunk
+    for X, y in iter_chunks(path, chunk_rows):
+        yield poly.transform((X - X_mean) / X_std), y
 
-            weight_updates.append(weights)
-            intercept_updates.append(intercept)
 
-        global_weights = np.mean(weight_updates, axis=0)
-        global_intercept = np.mean(intercept_updates)
+def stream_train(path, X_mean, X_std, poly, chunk_rows=CHUNK_ROWS, max_steps=NEWTON_STEPS, tol=TOL):
+    # Return (weights, intercept, passes run); theta holds the weights and
+    # the intercept last, which is not regularized
+    n_out = poly.n_output_features_
+    theta = np.zeros(n_out + 1)
+    reg = np.ones(n_out + 1)
+    reg[-1] = 0.0
+    for step in range(1, max_steps + 1):
+        grad = reg * theta
+        hess = np.diag(reg)
+        for X_poly, y in iter_poly_chunks(path, X_mean, X_std, poly, chunk_rows):
+            Xb = np.hstack([X_poly, np.ones((len(X_poly), 1))])
+            p = 0.5 * (1 + np.tanh((Xb @ theta) / 2))
+            grad += Xb.T @ (p - y)
+            hess += (Xb * (p * (1 - p))[:, None]).T @ Xb
+        update = np.linalg.solve(hess, grad)
+        theta -= update
+        if np.max(np.abs(update)) < tol:
+            print(f"Converged after {step} passes.")
+            break
+    return theta[:-1], theta[-1], step
 
+
+def stream_mcc(path, X_mean, X_std, poly, weights, intercept, chunk_rows=CHUNK_ROWS):
+    # Matthews correlation from confusion counts gathered chunk by chunk
+    tp = tn = fp = fn = 0
+    for X_poly, y in iter_poly_chunks(path, X_mean, X_std, poly, chunk_rows):
+        # A positive margin is a probability above 0.5
+        preds = (X_poly @ weights + intercept) > 0
+        y = y.astype(bool)
+        tp += int(np.sum(preds & y))
+        tn += int(np.sum(~preds & ~y))
+        fp += int(np.sum(preds & ~y))
+        fn += int(np.sum(~preds & y))
+    denom = np.sqrt(float(tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+    return (tp * tn - fp * fn) / denom if denom else 0.0
+
+
+def save_model(global_weights, global_intercept, X_mean, X_std, poly, model_file=MODEL_FILE,
+               params_path=PARAMS_PATH):
     # Save model
     with open(model_file, "wb") as f:
-        model = pickle.dumps((global_weights, global_intercept))
-        f.write(model)
+        f.write(pickle.dumps((global_weights, global_intercept)))
     print("Saved trained model.")
 
     # Save all params into one pickle bundle
@@ -81,11 +198,88 @@ if train_new_model:
         "poly": poly
     }
 
-    os.makedirs('output', exist_ok=True)
-    with open('output/params.pkl', 'wb') as f:
+    os.makedirs(os.path.dirname(params_path) or ".", exist_ok=True)
+    with open(params_path, "wb") as f:
         pickle.dump(model_bundle, f)
 
-# Training Evaluation
-train_preds = (X_poly @ global_weights + global_intercept) > 0.5
-train_mcc = matthews_corrcoef(y, train_preds)
-print(f"MCC on training set: {train_mcc:.4f}")
\ No newline at end of file
+
+def load_model(model_file=MODEL_FILE):
+    # Return (weights, intercept) of a saved model, or None to train a new one
+    if not os.path.exists(model_file):
+        print("No pre-trained model found. Training a new one...")
+        return None
+    try:
+        with open(model_file, "rb") as f:
+            global_weights, global_intercept = pickle.loads(f.read())
+    except (pickle.UnpicklingError, Exception):
+        print("Invalid model file. Training new model...")
+        os.remove(model_file)
+        return None
+    print("Loaded pre-trained model.")
+    return global_weights, global_intercept
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the diabetes model with federated averaging")
+    parser.add_argument("--data", default=DATA_PATH, help="training CSV with an Outcome column")
+    parser.add_argument("--model-file", default=MODEL_FILE,
+                        help="trained weights; training is skipped while this file exists")
+    parser.add_argument("--params-out", default=PARAMS_PATH, help="where to write the params.pkl bundle")
+    parser.add_argument("--clients", type=int, default=N_CLIENTS, help="number of federated client shards")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes training shards in parallel (1 trains in this process)")
+    parser.add_argument("--rounds", type=int, default=NUM_ROUNDS, help="maximum federated rounds")
+    parser.add_argument("--local-iters", type=int, default=LOCAL_ITERS,
+                        help="solver iterations per client per round")
+    parser.add_argument("--tol", type=float, default=TOL,
+                        help="stop once a round changes no weight by more than this")
+    parser.add_argument("--stream", action="store_true",
+                        help="train out of core: read --data (CSV or .xpt) in chunks instead of loading it")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per chunk with --stream")
+    args = parser.parse_args()
+    if args.stream and args.clients > 1:
+        parser.error("--stream trains a single model; it can't be combined with --clients")
+    if args.rounds < 1:
+        parser.error("--rounds must be at least 1")
+
+    model = load_model(args.model_file)
+    if args.stream:
+        X_mean, X_std = stream_stats(args.data, args.chunk_rows)
+        poly = PolynomialFeatures(degree=2, include_bias=False).fit(X_mean.reshape(1, -1))
+        if model is not None:
+            global_weights, global_intercept = model
+        else:
+            global_weights, global_intercept, _ = stream_train(args.data, X_mean, X_std, poly,
+                                                               args.chunk_rows, tol=args.tol)
+            save_model(global_weights, global_intercept, X_mean, X_std, poly, args.model_file, args.params_out)
+        train_mcc = stream_mcc(args.data, X_mean, X_std, poly, global_weights, global_intercept, args.chunk_rows)
+    else:
+        # Load training data
+        X, y = load_training_data(args.data)
+
+        # Normalize data
+        X_mean = np.mean(X, axis=0)
+        X_std = np.std(X, axis=0)
+        X = (X - X_mean) / X_std
+
+        # Polynomial expansion
+        poly = PolynomialFeatures(degree=2, include_bias=False)
+        X_poly = poly.fit_transform(X)
+
+        # Split into federated clients
+        X_clients = np.array_split(X_poly, args.clients)
+        y_clients = np.array_split(y, args.clients)
+
+        # Federated Training
+        if model is not None:
+            global_weights, global_intercept = model
+        else:
+            global_weights, global_intercept, _ = federated_train(
+                X_clients, y_clients, args.rounds, args.local_iters, args.tol, args.workers
+            )
+            save_model(global_weights, global_intercept, X_mean, X_std, poly, args.model_file, args.params_out)
+
+        # Training Evaluation
+        train_preds = (X_poly @ global_weights + global_intercept) > 0
+        train_mcc = matthews_corrcoef(y, train_preds)
+    print(f"MCC on training set: {train_mcc:.4f}")